@@ -1,43 +1,50 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from db import (
-    add_client, get_all_clients, count_bookings_for_period, decrement_visit,
-    set_session_value, get_session_value, clear_session_keys
+    add_client_async, add_clients_async, get_clients_page_async, get_occupancy_async, log_visit_async,
+    find_archived_clients_async, find_clients_async, get_client_async, CLIENT_PAGE_SIZE
 )
 from config import ADMIN_ID
+from schedule import schedule
 from telegram.error import BadRequest
 from datetime import datetime, timedelta
 from superuser import start_superuser_flow
+from session_store import session_store
+from text_router import text_router, ADMIN_WIZARD
+from callbacks import (
+    encode, decode, AddClient, ListClients, AvailableSlots, OfflineSuperuser, BackToMenu,
+    SlotPageNext, SlotPagePrev, ClientPageNext, ClientPagePrev, ClientCard, ClientVisits, PackageChoice, AdminBook
+)
+from history import start_history
+from metrics import summary as metrics_summary
 
 # Conversation states
 NAME, PHONE, CHILDREN, PACKAGE = range(4)
 DAYS_PER_PAGE = 5
 MAX_PAGES = 6
-
-all_periods = {
-    "08:00–11:00": 15, "11:00–14:00": 15, "14:00–17:00": 15, "17:00–20:00": 15,
-    "08:00–12:00": 10, "12:00–16:00": 10, "16:00–20:00": 10,
-    "08:00–14:00": 5, "14:00–20:00": 5
-}
+# Keeps the credentials reply under Telegram's message size limit
+MAX_BULK_CLIENTS = 50
 
 async def admin_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    if query.data == "add_client":
+    payload = decode(query.data)
+    if isinstance(payload, AddClient):
+        text_router.expect(update.effective_user.id, ADMIN_WIZARD)
         await query.message.edit_text("Enter client name:")
         return NAME
-    elif query.data == "offline_superuser":
+    elif isinstance(payload, OfflineSuperuser):
         return await start_superuser_flow(update, context)
-    elif query.data == "list_clients":
+    elif isinstance(payload, ListClients):
         await query.message.edit_text("📋 Listing clients coming soon...")
         return ConversationHandler.END
 
     keyboard = [
-        [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-        [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-        [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")],
-        [InlineKeyboardButton("📥 Offline Client", callback_data="offline_superuser")]
+        [InlineKeyboardButton("➕ Add Client", callback_data=encode(AddClient()))],
+        [InlineKeyboardButton("📋 List Clients", callback_data=encode(ListClients()))],
+        [InlineKeyboardButton("📊 Available Slots", callback_data=encode(AvailableSlots()))],
+        [InlineKeyboardButton("📥 Offline Client", callback_data=encode(OfflineSuperuser()))]
     ]
     try:
         await query.message.edit_text("Welcome Admin. Choose:", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -46,17 +53,49 @@ async def admin_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
             raise
     return ConversationHandler.END
 
-async def list_clients(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+async def list_clients(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
+    await update.callback_query.answer()
+    return await send_client_page(update, context)
 
-    clients = get_all_clients()
-    if not clients:
-        await query.message.edit_text("❌ No clients found.")
+async def client_page_next(update, context, payload=None):
+    await update.callback_query.answer()
+    state = context.user_data.get("client_page")
+    if not state:
+        return await send_client_page(update, context)
+    return await send_client_page(update, context, after=state["last"], number=state["number"] + 1)
+
+async def client_page_prev(update, context, payload=None):
+    await update.callback_query.answer()
+    state = context.user_data.get("client_page")
+    if not state or state["number"] <= 1:
+        return await send_client_page(update, context)
+    return await send_client_page(update, context, before=state["first"], number=state["number"] - 1)
+
+async def send_client_page(update, context, after=None, before=None, number=0):
+    # Only the rows of the requested page are fetched; the page edges are kept in user_data
+    rows, has_more, total = await get_clients_page_async(after=after, before=before)
+    if not rows and (after or before):
+        return await send_client_page(update, context)
+    if not rows:
+        await update.callback_query.message.edit_text("❌ No clients found.")
+        context.user_data.pop("client_page", None)
         return ConversationHandler.END
 
-    message = "📋 *Client List:*\n\n"
-    for i, (name, phone, children, package, visits_left, expire_date, client_id, password) in enumerate(clients, 1):
+    if before is not None:
+        has_prev, has_next = has_more, True
+        number = number if has_more else 0
+    else:
+        has_prev, has_next = after is not None, has_more
+    context.user_data["client_page"] = {
+        "number": number,
+        "first": (rows[0][0] or "", rows[0][6]),
+        "last": (rows[-1][0] or "", rows[-1][6]),
+    }
+
+    pages = (total + CLIENT_PAGE_SIZE - 1) // CLIENT_PAGE_SIZE
+    message = f"📋 *Client List — page {number + 1} of {max(pages, number + 1)}* ({total} clients)\n\n"
+    for i, (name, phone, children, package, visits_left, expire_date, client_id, password) in enumerate(
+            rows, number * CLIENT_PAGE_SIZE + 1):
         formatted_date = expire_date.strftime("%d/%m/%Y") if expire_date else "—"
         message += (
             f"{i}. 👤 *{name}* — {children} children\n"
@@ -65,32 +104,34 @@ async def list_clients(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"   📦 {package} visits, {visits_left} left, ⏳ until {formatted_date}\n\n"
         )
 
-    await query.message.edit_text(message, parse_mode="Markdown")
+    nav_row = []
+    if has_prev:
+        nav_row.append(InlineKeyboardButton("◀️ Prev", callback_data=encode(ClientPagePrev())))
+    if has_next:
+        nav_row.append(InlineKeyboardButton("Next ▶️", callback_data=encode(ClientPageNext())))
+    buttons = [nav_row] if nav_row else []
+    buttons.append([InlineKeyboardButton("🔁 Back to Menu", callback_data=encode(BackToMenu()))])
 
-    keyboard = [
-        [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-        [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-        [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")],
-        [InlineKeyboardButton("📥 Offline Client", callback_data="offline_superuser")]
-    ]
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="🔁 Choose next action:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    try:
+        await update.callback_query.message.edit_text(
+            message, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(buttons)
+        )
+    except BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
     return ConversationHandler.END
 
 # Step 1: Get client name
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    set_session_value(user_id, "name", update.message.text.strip())
+    await session_store.set(user_id, "name", update.message.text.strip())
     await update.message.reply_text("Enter phone number:")
     return PHONE
 
 # Step 2: Get phone number
 async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    set_session_value(user_id, "phone", update.message.text.strip())
+    await session_store.set(user_id, "phone", update.message.text.strip())
     await update.message.reply_text("How many children?")
     return CHILDREN
 
@@ -99,15 +140,14 @@ async def get_children(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     try:
         children = int(update.message.text.strip())
-        set_session_value(user_id, "children", children)
+        await session_store.set(user_id, "children", children)
     except ValueError:
         await update.message.reply_text("❌ Please enter a valid number.")
         return CHILDREN
 
     keyboard = [
-        [InlineKeyboardButton("8 Visits", callback_data="8")],
-        [InlineKeyboardButton("10 Visits", callback_data="10")],
-        [InlineKeyboardButton("12 Visits", callback_data="12")]
+        [InlineKeyboardButton(f"{package} Visits", callback_data=encode(PackageChoice(package)))]
+        for package in schedule.packages
     ]
     await update.message.reply_text("Choose package:", reply_markup=InlineKeyboardMarkup(keyboard))
     return PACKAGE
@@ -118,16 +158,14 @@ async def get_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
 
     try:
-        package = int(update.callback_query.data)
-        name = get_session_value(user_id, "name")
-        phone = get_session_value(user_id, "phone")
-        children = get_session_value(user_id, "children")
+        package = decode(update.callback_query.data).package
+        name, phone, children = await session_store.get_many(user_id, "name", "phone", "children")
 
         if not all([name, phone, children]):
             await update.callback_query.message.edit_text("⚠️ Session expired or invalid. Please /start again.")
             return ConversationHandler.END
 
-        client_id, password, start, expire = add_client(name, phone, children, package)
+        client_id, password, start, expire = await add_client_async(name, phone, children, package)
 
         await update.callback_query.message.edit_text(
             f"✅ Client added!\nID: `{client_id}`\nPassword: `{password}`\nValid till: {expire}",
@@ -135,13 +173,14 @@ async def get_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     finally:
-        clear_session_keys(user_id, ["name", "phone", "children"])
+        await session_store.clear_keys(user_id, ["name", "phone", "children"])
+        text_router.clear(user_id, ADMIN_WIZARD)
 
     keyboard = [
-        [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-        [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-        [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")],
-        [InlineKeyboardButton("📥 Offline Client", callback_data="offline_superuser")]
+        [InlineKeyboardButton("➕ Add Client", callback_data=encode(AddClient()))],
+        [InlineKeyboardButton("📋 List Clients", callback_data=encode(ListClients()))],
+        [InlineKeyboardButton("📊 Available Slots", callback_data=encode(AvailableSlots()))],
+        [InlineKeyboardButton("📥 Offline Client", callback_data=encode(OfflineSuperuser()))]
     ]
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -150,7 +189,129 @@ async def get_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
-async def show_available_slots(update, context):
+# /bulkadd <count> <package>: pre-create placeholder clients for onboarding events
+async def bulk_add_clients(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await update.message.reply_text("🚫 You are not authorized.")
+        return
+
+    try:
+        count, package = int(context.args[0]), int(context.args[1])
+    except (IndexError, ValueError):
+        count, package = 0, 0
+    if package not in schedule.packages or not 1 <= count <= MAX_BULK_CLIENTS:
+        packages = "|".join(map(str, schedule.packages))
+        await update.message.reply_text(f"Usage: /bulkadd <1-{MAX_BULK_CLIENTS}> <{packages}>")
+        return
+
+    label = datetime.today().strftime("%d/%m")
+    created = await add_clients_async(
+        [(f"Guest {label} #{i}", "—", None, package) for i in range(1, count + 1)]
+    )
+    lines = [f"{i}. ID: `{client_id}` | Password: `{password}`" for i, (client_id, password, _, _) in enumerate(created, 1)]
+    await update.message.reply_text(
+        f"✅ {len(created)} clients added ({package} visits, valid till {created[0][3]}):\n\n" + "\n".join(lines),
+        parse_mode="Markdown"
+    )
+
+def format_client(client):
+    expire_date = client.expire_date.strftime("%d/%m/%Y") if client.expire_date else "—"
+    return (
+        f"👤 *{client.full_name}* — {client.children_count} children\n"
+        f"📞 Phone number: {client.phone}\n"
+        f"🔑 ID: `{client.client_id}` | Password: `{client.password}`\n"
+        f"📦 {client.package_type} visits, {client.visits_remaining} left, ⏳ until {expire_date}"
+    )
+
+# /find <name, phone or client ID>: top matches, each opening the client's card
+async def find_clients(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await update.message.reply_text("🚫 You are not authorized.")
+        return
+
+    term = " ".join(context.args).strip()
+    if not term:
+        await update.message.reply_text("Usage: /find <name, phone or client ID>")
+        return
+
+    clients = await find_clients_async(term)
+    if not clients:
+        await update.message.reply_text("❌ No clients found. Past clients: /archived <ID or name>")
+        return
+
+    buttons = [
+        [InlineKeyboardButton(f"👤 {client.full_name} · {client.client_id} · {client.phone}",
+                              callback_data=encode(ClientCard(client.client_id)))]
+        for client in clients
+    ]
+    buttons.append([InlineKeyboardButton("🔁 Back to Menu", callback_data=encode(BackToMenu()))])
+    await update.message.reply_text(
+        f"🔎 {len(clients)} match(es) for “{term}”:", reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+async def show_client_card(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: ClientCard):
+    query = update.callback_query
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await query.answer("🚫 You are not authorized.", show_alert=True)
+        return
+    client = await get_client_async(payload.client_id)
+    if not client:
+        await query.answer("❌ Client not found (archived or removed).", show_alert=True)
+        return
+    await query.answer()
+    buttons = [
+        [InlineKeyboardButton("📜 Visits", callback_data=encode(ClientVisits(client.client_id)))],
+        [InlineKeyboardButton("🔁 Back to Menu", callback_data=encode(BackToMenu()))],
+    ]
+    await query.message.edit_text(format_client(client), parse_mode="Markdown",
+                                  reply_markup=InlineKeyboardMarkup(buttons))
+
+async def show_client_visits(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: ClientVisits):
+    query = update.callback_query
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await query.answer("🚫 You are not authorized.", show_alert=True)
+        return
+    client = await get_client_async(payload.client_id)
+    if not client:
+        await query.answer("❌ Client not found (archived or removed).", show_alert=True)
+        return
+    await start_history(update, context, client.id, client.full_name, admin=True)
+
+# /archived <client ID or name>: look up clients who used up or outlived their package
+async def archived_clients(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await update.message.reply_text("🚫 You are not authorized.")
+        return
+
+    term = " ".join(context.args).strip()
+    if not term:
+        await update.message.reply_text("Usage: /archived <client ID or name>")
+        return
+
+    rows = await find_archived_clients_async(term)
+    if not rows:
+        await update.message.reply_text("❌ No archived clients found.")
+        return
+
+    message = "🗄 *Archived Clients:*\n\n"
+    for i, (_, client_id, name, phone, children, package, visits_left, start_date, expire_date,
+            reason, archived_at, visits_logged) in enumerate(rows, 1):
+        period = " – ".join(d.strftime("%d/%m/%Y") if d else "—" for d in (start_date, expire_date))
+        message += (
+            f"{i}. 👤 *{name}* — {children} children\n"
+            f"   📞 Phone number: {phone}\n"
+            f"   🔑 ID: `{client_id}` | 📦 {package} visits, {visits_left} left, {visits_logged} logged\n"
+            f"   ⏳ {period} | archived {archived_at.strftime('%d/%m/%Y')} ({reason})\n\n"
+        )
+    await update.message.reply_text(message, parse_mode="Markdown")
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await update.message.reply_text("🚫 You are not authorized.")
+        return
+    await update.message.reply_text(metrics_summary())
+
+async def show_available_slots(update, context, payload=None):
     query = update.callback_query
     await query.answer()
     context.user_data["slot_page"] = 0
@@ -162,31 +323,30 @@ async def send_slot_page(update, context):
     start = page * DAYS_PER_PAGE
     end = start + DAYS_PER_PAGE
     message = f"📊 *Available Slots — Days {start + 1} to {end}*\n\n"
+    occupancy = await get_occupancy_async(
+        (today + timedelta(days=start)).date(), (today + timedelta(days=end - 1)).date()
+    )
 
     for i in range(start, end):
         current_day = today + timedelta(days=i)
         formatted_day = current_day.strftime("%d/%m/%Y")
         message += f"📅 *{formatted_day}*\n"
-        shown = set()
-        for period, max_cap in all_periods.items():
-            if period in shown:
-                continue
-            shown.add(period)
-            booked = count_bookings_for_period(current_day.date(), period)
-            available = max_cap - booked
-            message += f"{period} — {booked} booked/{available} available\n"
+        for slot in schedule.slots:
+            booked = occupancy.get((current_day.date(), slot.label), 0)
+            available = slot.capacity - booked
+            message += f"{slot.label} — {booked} booked/{available} available\n"
     message += f"\n📄 *Page {page + 1} of {MAX_PAGES}*"
 
     nav_row = []
     if page > 0:
-        nav_row.append(InlineKeyboardButton("◀️ Prev", callback_data="slot_prev"))
+        nav_row.append(InlineKeyboardButton("◀️ Prev", callback_data=encode(SlotPagePrev())))
     if page < MAX_PAGES - 1:
-        nav_row.append(InlineKeyboardButton("Next ▶️", callback_data="slot_next"))
+        nav_row.append(InlineKeyboardButton("Next ▶️", callback_data=encode(SlotPageNext())))
 
     buttons = []
     if nav_row:
         buttons.append(nav_row)
-    buttons.append([InlineKeyboardButton("🔁 Back to Menu", callback_data="back_to_menu")])
+    buttons.append([InlineKeyboardButton("🔁 Back to Menu", callback_data=encode(BackToMenu()))])
 
     keyboard = InlineKeyboardMarkup(buttons)
 
@@ -200,36 +360,39 @@ async def send_slot_page(update, context):
 
     return ConversationHandler.END
 
-async def slot_next(update, context):
+async def slot_next(update, context, payload=None):
     context.user_data["slot_page"] = context.user_data.get("slot_page", 0) + 1
     return await send_slot_page(update, context)
 
-async def slot_prev(update, context):
+async def slot_prev(update, context, payload=None):
     context.user_data["slot_page"] = max(0, context.user_data.get("slot_page", 0) - 1)
     return await send_slot_page(update, context)
 
-async def admin_manual_book(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def admin_manual_book(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: AdminBook):
     query = update.callback_query
     await query.answer()
 
     try:
-        _, date_str, time_period = query.data.split("_", 2)
-        visit_date = datetime.strptime(date_str, "%d-%m-%Y").date()
+        visit_date, time_period = payload.date, payload.period
 
         dummy_client_id = "admin_manual"
         dummy_visit_number = 0
 
-        decrement_visit(dummy_client_id, dummy_visit_number, visit_date, time_period)
+        # Not a client, so no visit is decremented: the place is reserved and logged together
+        if not await log_visit_async(dummy_client_id, dummy_visit_number, visit_date, time_period):
+            await query.answer("⛔ This slot is already full.", show_alert=True)
+            return
         await query.answer("✅ Slot booked manually!", show_alert=True)
         await show_available_slots(update, context)
     except Exception as e:
         await query.answer(f"❌ Error: {str(e)}", show_alert=True)
 
 async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text_router.clear(update.effective_user.id, ADMIN_WIZARD)
     keyboard = [
-        [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-        [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-        [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")]
+        [InlineKeyboardButton("➕ Add Client", callback_data=encode(AddClient()))],
+        [InlineKeyboardButton("📋 List Clients", callback_data=encode(ListClients()))],
+        [InlineKeyboardButton("📊 Available Slots", callback_data=encode(AvailableSlots()))]
     ]
     await update.message.reply_text(
         "❌ Canceled. Choose next action:",
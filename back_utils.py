@@ -1,6 +1,7 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from callbacks import encode, BackToMenu
 
 def append_back_button(keyboard_rows, include_back=True):
     if include_back:
-        keyboard_rows.append([InlineKeyboardButton("🔁 Вернуться в меню", callback_data="back_to_menu")])
+        keyboard_rows.append([InlineKeyboardButton("🔁 Вернуться в меню", callback_data=encode(BackToMenu()))])
     return InlineKeyboardMarkup(keyboard_rows)
@@ -0,0 +1,222 @@
+"""Micro-benchmarks for the db.py functions on the hot path.
+
+Seeds the database with realistic volumes (once; later runs reuse the data), times each
+operation and prints a table. Results can be saved as JSON and compared with a baseline:
+
+    python bench_db.py --save bench_baseline.json
+    python bench_db.py --baseline bench_baseline.json   # exits 1 on a regression
+
+Use a scratch database: seeded clients and visit logs are kept between runs.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import date, datetime, timedelta
+import db
+import partitions
+from schedule import schedule
+
+SEED_NAME = "Bench #"
+BENCH_TELEGRAM_ID = 1_900_000_000
+
+
+def seed(clients, visits):
+    with db.get_cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM clients WHERE full_name LIKE %s", (SEED_NAME + "%",))
+        have = cur.fetchone()[0]
+    if have < clients:
+        print(f"Seeding {clients - have} clients…")
+        packages = schedule.packages
+        db.add_clients([
+            (f"{SEED_NAME}{i}", f"+99890{i:07}", 1 + i % 3, packages[i % len(packages)])
+            for i in range(have, clients)
+        ])
+
+    with db.get_cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*) FROM visit_logs
+            WHERE client_pk IN (SELECT id FROM clients WHERE full_name LIKE %s)
+        """, (SEED_NAME + "%",))
+        have = cur.fetchone()[0]
+        if have >= visits:
+            return
+        print(f"Seeding {visits - have} visit logs…")
+        # A year of past bookings, so the upcoming slots stay free for the booking benchmarks
+        today = date.today()
+        partitions.create_partitions(cur, today - timedelta(days=366), today)
+        labels = [slot.label for slot in schedule.slots]
+        capacities = [slot.capacity for slot in schedule.slots]
+        cur.execute("""
+            WITH c AS (
+                SELECT array_agg(id ORDER BY id) AS ids, array_agg(client_id ORDER BY id) AS client_ids
+                FROM clients WHERE full_name LIKE %(name)s
+            ), rows AS (
+                INSERT INTO visit_logs (client_id, client_pk, visit_number, visit_date, time_period)
+                SELECT c.client_ids[1 + g %% cardinality(c.ids)], c.ids[1 + g %% cardinality(c.ids)],
+                       1 + g %% 8, CURRENT_DATE - 1 - (g %% 365), (%(labels)s::text[])[1 + g %% %(n)s]
+                FROM c, generate_series(1, %(count)s) g
+                RETURNING visit_date, time_period
+            )
+            INSERT INTO slot_counters (visit_date, time_period, capacity, booked)
+            SELECT visit_date, time_period, (%(capacities)s::int[])[array_position(%(labels)s::text[], time_period)],
+                   COUNT(*)
+            FROM rows GROUP BY visit_date, time_period
+            ON CONFLICT (visit_date, time_period) DO UPDATE SET booked = slot_counters.booked + EXCLUDED.booked
+        """, {"name": SEED_NAME + "%", "labels": labels, "capacities": capacities, "n": len(labels), "count": visits - have})
+        cur.execute("ANALYZE clients")
+        cur.execute("ANALYZE visit_logs")
+
+
+def timed(func, iterations, warmup=5):
+    for i in range(warmup):
+        func(i)
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(warmup + i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "min_ms": round(samples[0], 3),
+    }
+
+
+def benchmarks(iterations):
+    with db.get_cursor() as cur:
+        cur.execute("""
+            SELECT id, client_id, password, full_name FROM clients
+            WHERE full_name LIKE %s ORDER BY id LIMIT 1
+        """, (SEED_NAME + "%",))
+        client_pk, client_id, password, full_name = cur.fetchone()
+        # Enough visits that the booking benchmark never archives the client
+        cur.execute("UPDATE clients SET visits_remaining = 1000000 WHERE id = %s", (client_pk,))
+    db.invalidate_client(client_id)
+
+    today = date.today()
+    days = [today + timedelta(days=i) for i in range(1, 31)]
+    slots = [(day, slot.label) for day in days for slot in schedule.slots for _ in range(slot.capacity)]
+    labels = schedule.package_labels(schedule.packages[0])
+    tid = BENCH_TELEGRAM_ID
+
+    def uncached_get_client(i):
+        db.invalidate_client(client_id)
+        db.get_client(client_id)
+
+    ops = {
+        "set_session_value": lambda i: db.set_session_value(tid, "visit_time", f"v{i}"),
+        "get_session_value": lambda i: db.get_session_value(tid, "visit_time"),
+        "clear_session_keys": lambda i: db.clear_session_keys(tid, ["visit_time", "visit_day"]),
+        "load_session": lambda i: db.load_session(tid),
+        "save_session": lambda i: db.save_session(tid, None, {"last_visit": i, "visit_day": "01/01/2030"}, ["x"]),
+        "get_client": uncached_get_client,
+        "validate_password": lambda i: db.validate_password(client_id, password),
+        "count_bookings_for_period": lambda i: db.count_bookings_for_period(days[i % 30], labels[i % len(labels)]),
+        "get_occupancy_30d": lambda i: db.get_occupancy(days[0], days[-1]),
+        "get_full_days_30d": lambda i: db.get_full_days(days[0], days[-1], labels),
+        "get_clients_page_first": lambda i: db.get_clients_page(),
+        "get_clients_page_keyset": lambda i: db.get_clients_page(after=(f"{SEED_NAME}5", "")),
+        "find_clients_name": lambda i: db.find_clients("bench #1"),
+        "find_clients_phone": lambda i: db.find_clients("0001234"),
+        "get_visit_history": lambda i: db.get_visit_history(client_pk),
+        "decrement_visit": lambda i: db.decrement_visit(client_id, 1, *slots[i % len(slots)]),
+        "add_client": lambda i: db.add_client(f"Bench new #{i}", "+998900000000", 1, schedule.packages[0]),
+    }
+    results = {}
+    try:
+        for name, func in ops.items():
+            # Bookings are limited by slot capacity; never time more than there are places
+            count = min(iterations, len(slots) - 5) if name == "decrement_visit" else iterations
+            results[name] = timed(func, count)
+            print(f"  {name:<28} p50 {results[name]['p50_ms']:8.3f} ms   p95 {results[name]['p95_ms']:8.3f} ms")
+    finally:
+        cleanup(client_pk, client_id, days)
+    return results
+
+
+def cleanup(client_pk, client_id, days):
+    with db.get_cursor() as cur:
+        cur.execute("""
+            WITH logs AS (
+                DELETE FROM visit_logs
+                WHERE client_pk = %s AND visit_date BETWEEN %s AND %s
+                RETURNING visit_date, time_period
+            ), freed AS (
+                SELECT visit_date, time_period, COUNT(*) AS n FROM logs GROUP BY visit_date, time_period
+            )
+            UPDATE slot_counters s SET booked = s.booked - f.n
+            FROM freed f WHERE s.visit_date = f.visit_date AND s.time_period = f.time_period
+        """, (client_pk, days[0], days[-1]))
+        cur.execute("UPDATE clients SET visits_remaining = 8 WHERE id = %s", (client_pk,))
+        cur.execute("DELETE FROM clients WHERE full_name LIKE 'Bench new #%%'")
+        cur.execute("DELETE FROM sessions WHERE telegram_id = %s", (BENCH_TELEGRAM_ID,))
+    db.invalidate_client(client_id)
+
+
+def compare(results, baseline, tolerance):
+    # An operation regresses when its p50 grew by more than `tolerance` (and by 0.2 ms,
+    # so sub-millisecond noise does not count)
+    regressions = []
+    print(f"\n  {'operation':<28} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"  {name:<28} {'—':>10} {now['p50_ms']:>10.3f}      new")
+            continue
+        change = now["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0.0
+        regressed = change > tolerance and now["p50_ms"] - before["p50_ms"] > 0.2
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:<28} {before['p50_ms']:>10.3f} {now['p50_ms']:>10.3f} {change:>+7.0%}{'  ⚠' if regressed else ''}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=3000, help="seeded clients (at most ~9000: IDs are 4 digits)")
+    parser.add_argument("--visits", type=int, default=200_000, help="seeded visit_logs rows")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    db.init_db()
+    seed(args.clients, args.visits)
+    print(f"Running {args.iterations} iterations per operation…")
+    results = benchmarks(args.iterations)
+    db.close_pool()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+            "python": platform.python_version(), "clients": args.clients, "visits": args.visits,
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import logging
+from datetime import date
+from typing import NamedTuple, NewType, get_type_hints
+from schedule import schedule
+from routing import HandlerTable
+
+logger = logging.getLogger(__name__)
+
+# Callback data format: "<VERSION><code>[:field[:field...]]", e.g. "1d:20250614".
+# Bump VERSION whenever an encoding changes; buttons from older messages are then
+# recognised as stale instead of being misparsed.
+VERSION = "1"
+SEP = ":"
+STALE_BUTTON = "⚠️ Эта кнопка устарела. Пожалуйста, начните заново - /start."
+
+# A time period label ("08:00–11:00") travels as its short slot code ("0811")
+Period = NewType("Period", str)
+
+_types_by_code = {}
+_codes_by_type = {}
+
+
+def callback(code):
+    def register(payload_type):
+        if code in _types_by_code:
+            raise ValueError(f"Callback code {code!r} is already used by {_types_by_code[code].__name__}")
+        _types_by_code[code] = payload_type
+        _codes_by_type[payload_type] = code
+        payload_type.field_types = tuple(get_type_hints(payload_type).values())
+        return payload_type
+    return register
+
+
+# Menus
+@callback("a")
+class AddClient(NamedTuple):
+    pass
+
+
+@callback("l")
+class ListClients(NamedTuple):
+    pass
+
+
+@callback("s")
+class AvailableSlots(NamedTuple):
+    pass
+
+
+@callback(">")
+class SlotPageNext(NamedTuple):
+    pass
+
+
+@callback("<")
+class SlotPagePrev(NamedTuple):
+    pass
+
+
+@callback("]")
+class ClientPageNext(NamedTuple):
+    pass
+
+
+@callback("[")
+class ClientPagePrev(NamedTuple):
+    pass
+
+
+@callback("u")
+class OfflineSuperuser(NamedTuple):
+    pass
+
+
+@callback("b")
+class BackToMenu(NamedTuple):
+    pass
+
+
+@callback("o")
+class Logout(NamedTuple):
+    pass
+
+
+@callback("f")
+class SlotFull(NamedTuple):
+    pass
+
+
+@callback("i")
+class SlotStarted(NamedTuple):
+    pass
+
+
+@callback("n")
+class DayFull(NamedTuple):
+    pass
+
+
+# Client booking flow
+@callback("v")
+class VisitChoice(NamedTuple):
+    number: int
+
+
+@callback("d")
+class DayChoice(NamedTuple):
+    date: date
+
+
+@callback("t")
+class TimeChoice(NamedTuple):
+    period: Period
+
+
+# Admin
+@callback("k")
+class PackageChoice(NamedTuple):
+    package: int
+
+
+@callback("m")
+class AdminBook(NamedTuple):
+    date: date
+    period: Period
+
+
+@callback("c")
+class ClientCard(NamedTuple):
+    client_id: str
+
+
+# Visit history
+@callback("h")
+class MyVisits(NamedTuple):
+    pass
+
+
+@callback("w")
+class ClientVisits(NamedTuple):
+    client_id: str
+
+
+@callback("(")
+class HistoryOlder(NamedTuple):
+    pass
+
+
+@callback(")")
+class HistoryNewer(NamedTuple):
+    pass
+
+
+# Offline superuser flow
+@callback("P")
+class SuperPackage(NamedTuple):
+    package: int
+
+
+@callback("D")
+class SuperDay(NamedTuple):
+    date: date
+
+
+@callback("T")
+class SuperTime(NamedTuple):
+    period: Period
+
+
+def _encode_field(field_type, value):
+    if field_type is date:
+        return f"{value.year:04}{value.month:02}{value.day:02}"
+    if field_type is Period:
+        return schedule.by_label[value].code
+    return str(value)
+
+
+def _decode_field(field_type, raw):
+    if field_type is date:
+        return date(int(raw[:4]), int(raw[4:6]), int(raw[6:8]))
+    if field_type is Period:
+        return schedule.by_code[raw].label
+    return field_type(raw)
+
+
+def encode(payload):
+    parts = [VERSION + _codes_by_type[type(payload)]]
+    parts += [_encode_field(t, v) for t, v in zip(payload.field_types, payload)]
+    return SEP.join(parts)
+
+
+def decode(data):
+    # Returns the typed payload, or None for stale or unknown callback data
+    if not data or not data.startswith(VERSION):
+        return None
+    code, *raw_fields = data[len(VERSION):].split(SEP)
+    payload_type = _types_by_code.get(code)
+    if payload_type is None or len(raw_fields) != len(payload_type.field_types):
+        return None
+    try:
+        return payload_type(*(_decode_field(t, raw) for t, raw in zip(payload_type.field_types, raw_fields)))
+    except (ValueError, KeyError):
+        return None
+
+
+def pattern(payload_type):
+    # Regex for handlers that must stay outside the router (ConversationHandler states)
+    return f"^{VERSION}{_codes_by_type[payload_type]}(:|$)"
+
+
+class CallbackRouter(HandlerTable):
+    """Dispatches every inline button press through one handler and a prefix table.
+
+    Handlers are registered by payload type and called as handler(update, context, payload)
+    with the decoded payload.
+    """
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        payload = decode(query.data)
+        handler = self._handlers.get(type(payload))
+        if handler is None:
+            logger.debug("Stale or unknown callback data: %r", query.data)
+            await query.answer(STALE_BUTTON, show_alert=True)
+            return
+        return await handler(update, context, payload)
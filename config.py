@@ -7,4 +7,46 @@ BOT_TOKEN = os.getenv("bot_token")
 ADMIN_ID = int(os.getenv("admin_id"))
 SUPERUSER_ID = os.getenv("SUPERUSER_ID")
 SUPERUSER_PASSWORD = os.getenv("SUPERUSER_PASSWORD")
-NOTIFIER_BOT_TOKEN = os.getenv("notifier_bot_token")
\ No newline at end of file
+NOTIFIER_BOT_TOKEN = os.getenv("notifier_bot_token")
+NOTIFIER_API_URL = os.getenv("NOTIFIER_API_URL", "https://api.telegram.org")
+# 0 sends every admin notification on its own; > 0 merges those arriving within the window
+NOTIFY_DIGEST_SECONDS = float(os.getenv("NOTIFY_DIGEST_SECONDS", "0"))
+NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", "10"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+# "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Public base URL Telegram should call; leave empty to serve locally without registering
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "900"))
+# Expiry sweeper: seconds between runs (0 disables it) and rows deleted per statement
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "3600"))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "500"))
+# Months of visit_logs kept in full; older months are rolled up into daily totals (0 keeps all)
+VISIT_LOG_RETENTION_MONTHS = int(os.getenv("VISIT_LOG_RETENTION_MONTHS", "24"))
+# Sessions that never got past login are dropped after this many seconds of inactivity
+STALE_SESSION_AGE = float(os.getenv("STALE_SESSION_AGE", "86400"))
+# Prometheus endpoint (GET /metrics); 0 disables it. Bound to localhost unless told otherwise.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Per-update SQL tracing for development and load tests (see tracing.py): off unless DB_TRACE=1.
+# Statements repeated more than DB_TRACE_REPEAT_LIMIT times in one update are flagged.
+DB_TRACE = os.getenv("DB_TRACE", "").lower() in ("1", "true", "yes")
+DB_TRACE_REPEAT_LIMIT = int(os.getenv("DB_TRACE_REPEAT_LIMIT", "3"))
+# JSON-lines file for the traces; empty sends them to the regular log
+DB_TRACE_LOG = os.getenv("DB_TRACE_LOG", "")
+
+# Bookable time periods per package (number of visits) and the places in each slot.
+# A period may belong to one package only: its bookings are counted per period label.
+PACKAGES = {
+    8: {"capacity": 15, "periods": ["08:00–11:00", "11:00–14:00", "14:00–17:00", "17:00–20:00"]},
+    10: {"capacity": 10, "periods": ["08:00–12:00", "12:00–16:00", "16:00–20:00"]},
+    12: {"capacity": 5, "periods": ["08:00–14:00", "14:00–20:00"]},
+}
+# Places for slots whose period is not (or no longer) listed in PACKAGES
+DEFAULT_CAPACITY = 10
@@ -1,227 +1,654 @@
 import psycopg2
 import os
-import random
+import re
 import json
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from datetime import date, timedelta
-from config import SUPERUSER_ID, SUPERUSER_PASSWORD
+from config import SUPERUSER_ID, SUPERUSER_PASSWORD, VISIT_LOG_RETENTION_MONTHS
+from schedule import schedule
+from migrations import apply_migrations, SEARCH_NAME, SEARCH_PHONE
+import partitions
+from id_pool import CredentialPool
+from metrics import observe_db
+from tracing import TracingCursor
 
 
 load_dotenv()
 
-conn = psycopg2.connect(
+DB_PARAMS = dict(
     dbname=os.getenv("DB_NAME"),
     user=os.getenv("DB_USER"),
     password=os.getenv("DB_PASSWORD"),
     host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT")
+    port=os.getenv("DB_PORT"),
+    cursor_factory=TracingCursor,
 )
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Idle connections older than this (seconds) are pinged before being handed out
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises instead of waiting when exhausted, so callers queue here
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_PARAMS)
+        return _pool
+
+
+def _is_healthy(connection):
+    if connection.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(connection), 0) < DB_HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with connection.cursor() as cur:
+            cur.execute("SELECT 1")
+        connection.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def _checkout():
+    _pool_slots.acquire()
+    try:
+        pool = _get_pool()
+        connection = pool.getconn()
+        # Reconnect transparently if the server dropped the idle connection
+        while not _is_healthy(connection):
+            _last_used.pop(id(connection), None)
+            pool.putconn(connection, close=True)
+            connection = pool.getconn()
+        return connection
+    except BaseException:
+        _pool_slots.release()
+        raise
+
+
+def _checkin(connection):
+    try:
+        broken = bool(connection.closed)
+        if broken:
+            _last_used.pop(id(connection), None)
+        else:
+            _last_used[id(connection)] = time.monotonic()
+        _get_pool().putconn(connection, close=broken)
+    finally:
+        _pool_slots.release()
+
+
+@contextmanager
+def get_cursor():
+    # One pooled connection per call: commit on success, roll back on any error
+    connection = _checkout()
+    try:
+        with connection.cursor() as cur:
+            yield cur
+        connection.commit()
+    except BaseException:
+        if not connection.closed:
+            connection.rollback()
+        raise
+    finally:
+        _checkin(connection)
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
 
 
 def init_db():
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS clients (
-            id SERIAL PRIMARY KEY,
-            client_id TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            full_name TEXT,
-            phone TEXT,
-            children_count INTEGER,
-            package_type TEXT,
-            visits_remaining INTEGER,
-            start_date DATE,
-            expire_date DATE
-        );
-    """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS visit_logs (
-        id SERIAL PRIMARY KEY,
-        client_id TEXT,
-        visit_number INTEGER,
-        visit_date DATE,
-        time_period TEXT
-        );
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS sessions (
-            telegram_id BIGINT PRIMARY KEY,
-            client_id TEXT NOT NULL,
-            login_time TIMESTAMP DEFAULT NOW()
-        );
-    """)
-    cur.execute("""
-    ALTER TABLE sessions
-    ADD COLUMN IF NOT EXISTS data JSONB DEFAULT '{}';
-    """)
-    conn.commit()
-    cur.close()
+    with get_cursor() as cur:
+        applied = apply_migrations(cur)
+    if applied:
+        print(f"✅ Applied schema migrations: {', '.join(map(str, applied))}")
+    maintain_visit_logs()
+
+
+def maintain_visit_logs(keep_months=VISIT_LOG_RETENTION_MONTHS, today=None):
+    # Creates the upcoming monthly partitions and retires the ones past the retention horizon
+    today = today or date.today()
+    with get_cursor() as cur:
+        created = partitions.create_partitions(
+            cur, today, partitions.add_months(partitions.month_start(today), partitions.MONTHS_AHEAD)
+        )
+        dropped = partitions.drop_expired_partitions(cur, keep_months, today) if keep_months > 0 else []
+    return created, dropped
 
 
 def ensure_superuser():
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM clients WHERE client_id = %s", (SUPERUSER_ID,))
-    if not cur.fetchone():
-        cur.execute("""
-            INSERT INTO clients (client_id, password, full_name, phone, package_type, visits_remaining)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (SUPERUSER_ID, SUPERUSER_PASSWORD, 'Offline Superuser', 'N/A', 'super', None))
-        conn.commit()
-        print("✅ Superuser created in DB.")
-    else:
-        print("✅ Superuser already exists.")
-    cur.close()
+    with get_cursor() as cur:
+        cur.execute("SELECT * FROM clients WHERE client_id = %s", (SUPERUSER_ID,))
+        if not cur.fetchone():
+            cur.execute("""
+                INSERT INTO clients (client_id, password, full_name, phone, package_type, visits_remaining)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (SUPERUSER_ID, SUPERUSER_PASSWORD, 'Offline Superuser', 'N/A', 'super', None))
+            invalidate_client(SUPERUSER_ID)
+            print("✅ Superuser created in DB.")
+        else:
+            print("✅ Superuser already exists.")
 
 
-def add_client(full_name, phone, children_count, package_type):
-    cur = conn.cursor()
-    visits = package_type
+credential_pool = CredentialPool()
+
+
+def _credential_pool():
+    if not credential_pool.loaded:
+        with get_cursor() as cur:
+            cur.execute("SELECT client_id, password FROM clients")
+            rows = cur.fetchall()
+        credential_pool.load((r[0] for r in rows), (r[1] for r in rows))
+    return credential_pool
+
+
+def add_clients(new_clients):
+    # Bulk insert of (full_name, phone, children_count, package_type) tuples in one statement.
+    # Returns (client_id, password, start, expire) for each client, in input order.
+    pool = _credential_pool()
     start = date.today()
     expire = start + timedelta(days=30)
+    pending = list(enumerate(new_clients))
+    created = {}
+
+    while pending:
+        credentials = pool.take_many(len(pending))
+        rows = [
+            (client_id, password, full_name, phone, children_count, package_type, package_type, start, expire)
+            for (_, (full_name, phone, children_count, package_type)), (client_id, password) in zip(pending, credentials)
+        ]
+        with get_cursor() as cur:
+            inserted = execute_values(cur, """
+                INSERT INTO clients (client_id, password, full_name, phone, children_count, package_type, visits_remaining, start_date, expire_date)
+                VALUES %s
+                ON CONFLICT (client_id) DO NOTHING
+                RETURNING client_id
+            """, rows, fetch=True)
+        inserted = {row[0] for row in inserted}
+
+        retry = []
+        for (i, new_client), (client_id, password) in zip(pending, credentials):
+            invalidate_client(client_id)
+            if client_id in inserted:
+                created[i] = (client_id, password, start, expire)
+            else:
+                # Taken by another instance since the pool was loaded; draw again
+                pool.mark_used(client_id)
+                retry.append((i, new_client))
+        pending = retry
+
+    return [created[i] for i in range(len(created))]
 
-    while True:
-        client_id = f"{random.randint(0, 9999):04}"
-        cur.execute("SELECT 1 FROM clients WHERE client_id = %s", (client_id,))
-        if not cur.fetchone():
-            break
 
-    while True:
-        password = f"{random.randint(0, 999999):06}"
-        cur.execute("SELECT 1 FROM clients WHERE password = %s", (password,))
-        if not cur.fetchone():
-            break
+def add_client(full_name, phone, children_count, package_type):
+    return add_clients([(full_name, phone, children_count, package_type)])[0]
+
+
+CLIENT_PAGE_SIZE = 10
+
+
+def get_clients_page(after=None, before=None, limit=CLIENT_PAGE_SIZE):
+    # One page of clients ordered by (full_name, client_id), found by keyset instead of OFFSET:
+    # `after`/`before` is the (full_name, client_id) key of the last/first row of the page
+    # currently shown. Returns (rows, has_more, total); has_more is about the direction taken.
+    key = "(COALESCE(full_name, ''), client_id)"
+    columns = "full_name, phone, children_count, package_type, visits_remaining, expire_date, client_id, password"
+    with get_cursor() as cur:
+        if before is not None:
+            cur.execute(f"""
+                SELECT {columns} FROM clients WHERE {key} < (%s, %s)
+                ORDER BY COALESCE(full_name, '') DESC, client_id DESC LIMIT %s
+            """, (*before, limit + 1))
+        elif after is not None:
+            cur.execute(f"""
+                SELECT {columns} FROM clients WHERE {key} > (%s, %s)
+                ORDER BY COALESCE(full_name, ''), client_id LIMIT %s
+            """, (*after, limit + 1))
+        else:
+            cur.execute(f"""
+                SELECT {columns} FROM clients
+                ORDER BY COALESCE(full_name, ''), client_id LIMIT %s
+            """, (limit + 1,))
+        rows = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM clients")
+        total = cur.fetchone()[0]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more, total
+
+
+class Client:
+    # Compact, attribute-based view of a clients row
+    __slots__ = (
+        "id", "client_id", "password", "full_name", "phone", "children_count",
+        "package_type", "visits_remaining", "start_date", "expire_date"
+    )
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"Client({self.client_id!r}, {self.full_name!r})"
+
+
+CLIENT_COLUMNS = ", ".join(Client.__slots__)
+CLIENT_CACHE_TTL = float(os.getenv("CLIENT_CACHE_TTL", "60"))
+
+_client_cache = {}
+_client_cache_lock = threading.Lock()
+
+
+def invalidate_client(client_id):
+    with _client_cache_lock:
+        _client_cache.pop(client_id, None)
+
 
+def get_client(client_id):
+    # Read-through cache; writers in this module invalidate, the TTL bounds staleness
+    # against changes made by other processes
+    with _client_cache_lock:
+        cached = _client_cache.get(client_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    with get_cursor() as cur:
+        cur.execute(f"SELECT {CLIENT_COLUMNS} FROM clients WHERE client_id = %s", (client_id,))
+        row = cur.fetchone()
+    client = Client(*row) if row else None
+    if client:
+        with _client_cache_lock:
+            _client_cache[client_id] = (client, time.monotonic() + CLIENT_CACHE_TTL)
+    return client
+
+
+def validate_password(client_id, password):
+    client = get_client(client_id)
+    return client if client and client.password == password else None
+
+
+FIND_LIMIT = 8
+_trigram_search = None
+
+
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def find_clients(term, limit=FIND_LIMIT):
+    # Active clients matching a client ID, a name prefix or substring, or phone digits.
+    # Exact ID first, then name-prefix matches, then alphabetical.
+    global _trigram_search
+    name = _like_escape(term.strip().lower())
+    digits = re.sub(r"\D", "", term)
+    with get_cursor() as cur:
+        if _trigram_search is None:
+            cur.execute("SELECT to_regclass('clients_name_trgm_idx') IS NOT NULL")
+            _trigram_search = cur.fetchone()[0]
+
+        # Without pg_trgm a substring match cannot use an index: names are then matched by
+        # prefix and phones by their first or last digits
+        conditions = ["client_id = %(term)s", f"{SEARCH_NAME} LIKE %(contains)s" if _trigram_search
+                      else f"{SEARCH_NAME} LIKE %(prefix)s"]
+        if len(digits) >= 3:
+            conditions += [f"{SEARCH_PHONE} LIKE %(phone)s"] if _trigram_search else [
+                f"{SEARCH_PHONE} LIKE %(phone_prefix)s", f"reverse{SEARCH_PHONE} LIKE %(phone_suffix)s"
+            ]
+        cur.execute(f"""
+            SELECT {CLIENT_COLUMNS} FROM clients
+            WHERE {" OR ".join(conditions)}
+            ORDER BY client_id = %(term)s DESC, {SEARCH_NAME} LIKE %(prefix)s DESC,
+                     COALESCE(full_name, ''), client_id
+            LIMIT %(limit)s
+        """, {"term": term.strip(), "prefix": name + "%", "contains": f"%{name}%", "phone": f"%{digits}%",
+              "phone_prefix": digits + "%", "phone_suffix": digits[::-1] + "%", "limit": limit})
+        return [Client(*row) for row in cur.fetchall()]
+
+
+def _reserve_slot(cur, date_value, time_period):
+    # Take one place atomically; the row lock serialises concurrent bookings of the same slot.
+    # The configured capacity wins over the stored one, so a changed schedule applies to
+    # counters created before the change.
     cur.execute("""
-        INSERT INTO clients (client_id, password, full_name, phone, children_count, package_type, visits_remaining, start_date, expire_date)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (client_id, password, full_name, phone, children_count, package_type, visits, start, expire))
-    conn.commit()
-    cur.close()
-    return client_id, password, start, expire
+        INSERT INTO slot_counters (visit_date, time_period, capacity, booked)
+        VALUES (%s, %s, %s, 1)
+        ON CONFLICT (visit_date, time_period) DO UPDATE
+        SET booked = slot_counters.booked + 1, capacity = EXCLUDED.capacity
+        WHERE slot_counters.booked < EXCLUDED.capacity
+        RETURNING booked
+    """, (date_value, time_period, schedule.capacity(time_period)))
+    return cur.fetchone() is not None
 
 
-def get_all_clients():
-    cur = conn.cursor()
+def _insert_visit_log(cur, client_id, visit_number, date_value, time_period):
     cur.execute("""
-        SELECT full_name, phone, children_count, package_type, visits_remaining, expire_date, client_id, password
-        FROM clients ORDER BY full_name
-    """)
-    result = cur.fetchall()
-    cur.close()
-    return result
+        INSERT INTO visit_logs (client_id, client_pk, visit_number, visit_date, time_period)
+        VALUES (%s, (SELECT id FROM clients WHERE client_id = %s), %s, %s, %s)
+    """, (client_id, client_id, visit_number, date_value, time_period))
 
 
-def get_client(client_id):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM clients WHERE client_id = %s", (client_id,))
-    result = cur.fetchone()
-    cur.close()
-    return result
+ARCHIVE_COLUMNS = (
+    "id, client_id, full_name, phone, children_count, package_type, "
+    "visits_remaining, start_date, expire_date"
+)
 
 
-def validate_password(client_id, password):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM clients WHERE client_id = %s AND password = %s", (client_id, password))
-    result = cur.fetchone()
-    cur.close()
-    return result
+def _archive_clients(cur, selection, params):
+    # Moves the clients picked by `selection` (a query returning clients.id) to
+    # clients_archive, drops their sessions and returns (client_id, password) of each
+    cur.execute(f"""
+        WITH gone AS (
+            DELETE FROM clients WHERE id IN ({selection})
+            RETURNING *
+        ), archived AS (
+            INSERT INTO clients_archive ({ARCHIVE_COLUMNS}, reason)
+            SELECT {ARCHIVE_COLUMNS},
+                   CASE WHEN visits_remaining <= 0 THEN 'used' ELSE 'expired' END
+            FROM gone
+        ), dropped AS (
+            DELETE FROM sessions WHERE client_id IN (SELECT client_id FROM gone)
+        )
+        SELECT client_id, password FROM gone
+    """, params)
+    return cur.fetchall()
 
 
 def decrement_visit(client_id, visit_number=None, date_value=None, time_period=None):
-    cur = conn.cursor()
+    # Returns False (and changes nothing) when the requested slot is already full or the
+    # client has no visit left (used up, archived meanwhile or unknown)
+    with get_cursor() as cur:
+        # Step 1: Reserve the slot
+        if date_value and time_period and not _reserve_slot(cur, date_value, time_period):
+            return False
+
+        # Step 2: Decrement visit
+        cur.execute("""
+            UPDATE clients SET visits_remaining = visits_remaining - 1
+            WHERE client_id = %s AND visits_remaining > 0
+            RETURNING visits_remaining
+        """, (client_id,))
+        row = cur.fetchone()
+        if row is None:
+            # Give the reserved place back
+            cur.connection.rollback()
+            invalidate_client(client_id)
+            return False
+        deleted = None
+
+        # Step 3: Log visit; a reserved place always gets its log row
+        if date_value and time_period:
+            _insert_visit_log(cur, client_id, visit_number, date_value, time_period)
+
+        # Step 4: Archive the client (and drop its sessions) once the last visit is used
+        if row[0] == 0:
+            deleted = _archive_clients(cur, "SELECT id FROM clients WHERE client_id = %s", (client_id,))
+    invalidate_client(client_id)
+    for _, password in deleted or ():
+        credential_pool.release(client_id, password)
+    return True
+
+
+def log_visit(client_id, visit_number, date_value, time_period):
+    with get_cursor() as cur:
+        if not _reserve_slot(cur, date_value, time_period):
+            return False
+        _insert_visit_log(cur, client_id, visit_number, date_value, time_period)
+    return True
 
-    # Step 1: Decrement visit
-    cur.execute("""
-        UPDATE clients SET visits_remaining = visits_remaining - 1
-        WHERE client_id = %s AND visits_remaining > 0
-    """, (client_id,))
 
-    # Step 2: Log visit
-    if visit_number and date_value and time_period:
+def count_bookings_for_period(date_value, time_period):
+    with get_cursor() as cur:
         cur.execute("""
-            INSERT INTO visit_logs (client_id, visit_number, visit_date, time_period)
-            VALUES (%s, %s, %s, %s)
-        """, (client_id, visit_number, date_value, time_period))
-
-    # Step 3: Commit the decrement so SELECT sees updated value
-    conn.commit()
+            SELECT booked FROM slot_counters
+            WHERE visit_date = %s AND time_period = %s
+        """, (date_value, time_period))
+        row = cur.fetchone()
+        return row[0] if row else 0
 
-    # Step 4: Check remaining visits and delete if 0
-    cur.execute("SELECT visits_remaining FROM clients WHERE client_id = %s", (client_id,))
-    row = cur.fetchone()
-    if row and row[0] == 0:
-        cur.execute("DELETE FROM clients WHERE client_id = %s", (client_id,))
-        cur.execute("DELETE FROM sessions WHERE client_id = %s", (client_id,))
-        conn.commit()
 
-    cur.close()
+def get_occupancy(start_date, end_date):
+    # Booked counts for every (date, time_period) in [start_date, end_date] in one round trip
+    with get_cursor() as cur:
+        cur.execute("""
+            SELECT visit_date, time_period, booked FROM slot_counters
+            WHERE visit_date BETWEEN %s AND %s
+        """, (start_date, end_date))
+        return {(visit_date, time_period): booked for visit_date, time_period, booked in cur.fetchall()}
 
 
-def count_bookings_for_period(date_value, time_period):
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT COUNT(*) FROM visit_logs
-        WHERE visit_date = %s AND time_period = %s
-    """, (date_value, time_period))
-    count = cur.fetchone()[0]
-    cur.close()
-    return count
+def get_full_days(start_date, end_date, periods, started=()):
+    # Days in [start_date, end_date] on which none of the given periods is bookable: each one
+    # is fully booked (against the configured capacity) or, on start_date, among the `started` periods
+    periods = list(periods)
+    with get_cursor() as cur:
+        cur.execute("""
+            SELECT visit_date FROM (
+                SELECT s.visit_date, s.time_period FROM slot_counters s
+                JOIN unnest(%(periods)s::text[], %(capacities)s::int[]) AS c(time_period, capacity)
+                    ON c.time_period = s.time_period
+                WHERE s.visit_date BETWEEN %(start)s AND %(end)s AND s.booked >= c.capacity
+                UNION
+                SELECT %(start)s::date, time_period FROM unnest(%(started)s::text[]) AS time_period
+                WHERE time_period = ANY(%(periods)s)
+            ) unavailable
+            GROUP BY visit_date
+            HAVING COUNT(*) = %(count)s
+        """, {"start": start_date, "end": end_date, "periods": periods,
+              "capacities": [schedule.capacity(period) for period in periods], "started": list(started),
+              "count": len(periods)})
+        return {row[0] for row in cur.fetchall()}
 
 
 def set_session_value(user_id, key, value):
-
-    try:
-        conn.rollback()  # Clean failed transaction state if any
-    except:
-        pass
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM sessions WHERE telegram_id = %s", (user_id,))
-    exists = cur.fetchone()
-    if exists:
-        cur.execute("""
-            UPDATE sessions SET data = jsonb_set(data, %s, %s, true)
-            WHERE telegram_id = %s
-        """, (f'{{{key}}}', json.dumps(value), user_id))
-    else:
+    with get_cursor() as cur:
         # Set dummy client_id for initial insert
         cur.execute("""
             INSERT INTO sessions (telegram_id, client_id, data)
             VALUES (%s, %s, %s)
-        """, (user_id, 'temp', json.dumps({key: value})))
-    conn.commit()
-    cur.close()
+            ON CONFLICT (telegram_id) DO UPDATE
+            SET data = jsonb_set(COALESCE(sessions.data, '{}'), %s, %s, true),
+                updated_at = NOW()
+        """, (user_id, 'temp', json.dumps({key: value}), f'{{{key}}}', json.dumps(value)))
 
 
 def get_session_value(telegram_id, key):
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT data->>%s FROM sessions WHERE telegram_id = %s
-    """, (key, telegram_id))
-    row = cur.fetchone()
-    cur.close()
-    return row[0] if row else None
+    with get_cursor() as cur:
+        cur.execute("""
+            SELECT data->>%s FROM sessions WHERE telegram_id = %s
+        """, (key, telegram_id))
+        row = cur.fetchone()
+        return row[0] if row else None
 
 
-def clear_session_keys(telegram_id, keys):
-    cur = conn.cursor()
-    for key in keys:
+def load_session(telegram_id):
+    with get_cursor() as cur:
+        cur.execute("SELECT client_id, data FROM sessions WHERE telegram_id = %s", (telegram_id,))
+        return cur.fetchone()
+
+
+def save_session(telegram_id, client_id, updates, removed_keys):
+    # Write back all pending changes of one session in a single statement
+    with get_cursor() as cur:
         cur.execute("""
-            UPDATE sessions SET data = data - %s WHERE telegram_id = %s
-        """, (key, telegram_id))
-    conn.commit()
-    cur.close()
+            INSERT INTO sessions (telegram_id, client_id, data)
+            VALUES (%s, COALESCE(%s, 'temp'), %s)
+            ON CONFLICT (telegram_id) DO UPDATE
+            SET client_id = COALESCE(%s, sessions.client_id),
+                data = (COALESCE(sessions.data, '{}') - %s::text[]) || EXCLUDED.data,
+                updated_at = NOW()
+        """, (telegram_id, client_id, json.dumps(updates), client_id, list(removed_keys)))
+
+
+def get_session_client_id(telegram_id):
+    with get_cursor() as cur:
+        cur.execute("SELECT client_id FROM sessions WHERE telegram_id = %s", (telegram_id,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def bind_session(telegram_id, client_id):
+    with get_cursor() as cur:
+        cur.execute("""
+            INSERT INTO sessions (telegram_id, client_id)
+            VALUES (%s, %s)
+            ON CONFLICT (telegram_id) DO UPDATE SET client_id = EXCLUDED.client_id, updated_at = NOW()
+        """, (telegram_id, client_id))
+
+
+def delete_session(telegram_id):
+    with get_cursor() as cur:
+        cur.execute("DELETE FROM sessions WHERE telegram_id = %s", (telegram_id,))
 
 
 def clear_session_keys(telegram_id: int, keys: list):
     if not keys:
         return
 
-    cur = conn.cursor()
-    query = f"""
-        UPDATE sessions
-        SET data = data #- ARRAY[{', '.join(f"'{key}'" for key in keys)}]
-        WHERE telegram_id = %s
-    """
-    cur.execute(query, (telegram_id,))
-    conn.commit()
-    cur.close()
\ No newline at end of file
+    with get_cursor() as cur:
+        cur.execute("""
+            UPDATE sessions
+            SET data = data - %s::text[]
+            WHERE telegram_id = %s
+        """, (list(keys), telegram_id))
+
+
+def sweep_expired_clients(batch_size):
+    # Archives up to batch_size expired or used-up clients and drops their sessions.
+    # The superuser has no expiry date or visit count and is never matched.
+    with get_cursor() as cur:
+        rows = _archive_clients(cur, """
+            SELECT id FROM clients
+            WHERE expire_date < CURRENT_DATE OR visits_remaining <= 0
+            ORDER BY id LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+    for client_id, password in rows:
+        invalidate_client(client_id)
+        credential_pool.release(client_id, password)
+    return [client_id for client_id, _ in rows]
+
+
+HISTORY_PAGE_SIZE = 10
+
+
+def get_visit_history(client_pk, older_than=None, newer_than=None, limit=HISTORY_PAGE_SIZE):
+    # One page of a client's bookings, newest first, by keyset on (visit_date, id):
+    # `older_than`/`newer_than` is the key of the last/first row of the page currently shown.
+    # Returns (rows, has_more) with rows of (id, visit_number, visit_date, time_period).
+    with get_cursor() as cur:
+        if newer_than is not None:
+            cur.execute("""
+                SELECT id, visit_number, visit_date, time_period FROM visit_logs
+                WHERE client_pk = %s AND (visit_date, id) > (%s, %s)
+                ORDER BY visit_date, id LIMIT %s
+            """, (client_pk, *newer_than, limit + 1))
+        elif older_than is not None:
+            cur.execute("""
+                SELECT id, visit_number, visit_date, time_period FROM visit_logs
+                WHERE client_pk = %s AND (visit_date, id) < (%s, %s)
+                ORDER BY visit_date DESC, id DESC LIMIT %s
+            """, (client_pk, *older_than, limit + 1))
+        else:
+            cur.execute("""
+                SELECT id, visit_number, visit_date, time_period FROM visit_logs
+                WHERE client_pk = %s
+                ORDER BY visit_date DESC, id DESC LIMIT %s
+            """, (client_pk, limit + 1))
+        rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer_than is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+def find_archived_clients(term, limit=10):
+    # Archived clients by exact client ID or name prefix, newest first, with their logged visits
+    with get_cursor() as cur:
+        cur.execute(f"""
+            SELECT {ARCHIVE_COLUMNS}, reason, archived_at,
+                   (SELECT COUNT(*) FROM visit_logs l WHERE l.client_pk = a.id) AS visits_logged
+            FROM clients_archive a
+            WHERE a.client_id = %s OR a.full_name ILIKE %s
+            ORDER BY a.archived_at DESC
+            LIMIT %s
+        """, (term, _like_escape(term) + "%", limit))
+        return cur.fetchall()
+
+
+def sweep_stale_sessions(batch_size, max_age_seconds):
+    # Deletes up to batch_size sessions that never finished logging in within max_age_seconds
+    # or whose client no longer exists
+    with get_cursor() as cur:
+        cur.execute("""
+            DELETE FROM sessions WHERE telegram_id IN (
+                SELECT s.telegram_id FROM sessions s
+                WHERE (s.client_id = 'temp' AND s.updated_at < NOW() - make_interval(secs => %s))
+                   OR (s.client_id <> 'temp'
+                       AND NOT EXISTS (SELECT 1 FROM clients c WHERE c.client_id = s.client_id))
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (max_age_seconds, batch_size))
+        return cur.rowcount
+
+
+# Awaitable equivalents: run the blocking call on a worker thread so the
+# event loop keeps serving other users while a query is in flight.
+def _to_thread(func):
+    func = observe_db(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+
+init_db_async = _to_thread(init_db)
+ensure_superuser_async = _to_thread(ensure_superuser)
+add_client_async = _to_thread(add_client)
+add_clients_async = _to_thread(add_clients)
+get_clients_page_async = _to_thread(get_clients_page)
+find_clients_async = _to_thread(find_clients)
+get_client_async = _to_thread(get_client)
+validate_password_async = _to_thread(validate_password)
+decrement_visit_async = _to_thread(decrement_visit)
+log_visit_async = _to_thread(log_visit)
+count_bookings_for_period_async = _to_thread(count_bookings_for_period)
+get_occupancy_async = _to_thread(get_occupancy)
+get_full_days_async = _to_thread(get_full_days)
+set_session_value_async = _to_thread(set_session_value)
+get_session_value_async = _to_thread(get_session_value)
+load_session_async = _to_thread(load_session)
+save_session_async = _to_thread(save_session)
+get_session_client_id_async = _to_thread(get_session_client_id)
+bind_session_async = _to_thread(bind_session)
+delete_session_async = _to_thread(delete_session)
+sweep_expired_clients_async = _to_thread(sweep_expired_clients)
+sweep_stale_sessions_async = _to_thread(sweep_stale_sessions)
+maintain_visit_logs_async = _to_thread(maintain_visit_logs)
+find_archived_clients_async = _to_thread(find_archived_clients)
+get_visit_history_async = _to_thread(get_visit_history)
+clear_session_keys_async = _to_thread(clear_session_keys)
@@ -0,0 +1,91 @@
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from db import get_visit_history_async, HISTORY_PAGE_SIZE
+from back_utils import append_back_button
+from callbacks import encode, STALE_BUTTON, BackToMenu, HistoryOlder, HistoryNewer
+
+# Client-facing texts are Russian, the admin's English
+TEXTS = {
+    False: {
+        "title": "📜 Ваши посещения", "page": "стр.", "empty": "📜 У вас пока нет посещений.",
+        "visit": "Посещение", "older": "◀️ Раньше", "newer": "Позже ▶️",
+    },
+    True: {
+        "title": "📜 Visits of {name}", "page": "page", "empty": "📜 {name} has no visits yet.",
+        "visit": "Visit", "older": "◀️ Older", "newer": "Newer ▶️",
+    },
+}
+
+
+async def start_history(update, context, client_pk, name, admin):
+    # Whose history is shown lives in user_data, so page buttons cannot be pointed at another client
+    context.user_data["history"] = {"client_pk": client_pk, "name": name, "admin": admin}
+    await update.callback_query.answer()
+    return await send_history_page(update, context)
+
+
+async def history_older(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
+    state = context.user_data.get("history")
+    if not state or "last" not in state:
+        await update.callback_query.answer(STALE_BUTTON, show_alert=True)
+        return
+    await update.callback_query.answer()
+    return await send_history_page(update, context, older_than=state["last"], number=state["number"] + 1)
+
+
+async def history_newer(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
+    state = context.user_data.get("history")
+    if not state or "first" not in state:
+        await update.callback_query.answer(STALE_BUTTON, show_alert=True)
+        return
+    await update.callback_query.answer()
+    if state["number"] <= 1:
+        return await send_history_page(update, context)
+    return await send_history_page(update, context, newer_than=state["first"], number=state["number"] - 1)
+
+
+async def send_history_page(update, context, older_than=None, newer_than=None, number=0):
+    # The callers answer the callback query; this may run twice for one press
+    query = update.callback_query
+    state = context.user_data["history"]
+    texts = TEXTS[state["admin"]]
+
+    rows, has_more = await get_visit_history_async(state["client_pk"], older_than, newer_than)
+    if not rows and (older_than or newer_than):
+        return await send_history_page(update, context)
+
+    if newer_than is not None:
+        has_newer, has_older = has_more, True
+        number = number if has_more else 0
+    else:
+        has_newer, has_older = older_than is not None, has_more
+
+    if rows:
+        state.update(number=number, first=(rows[0][2], rows[0][0]), last=(rows[-1][2], rows[-1][0]))
+        message = f"{texts['title'].format(name=state['name'])} ({texts['page']} {number + 1}):\n\n"
+        message += "\n".join(
+            f"{i}. {visit_date.strftime('%d/%m/%Y')}, {period}" +
+            (f" — {texts['visit']} {visit_number}" if visit_number else "")
+            for i, (_, visit_number, visit_date, period) in enumerate(rows, number * HISTORY_PAGE_SIZE + 1)
+        )
+    else:
+        message = texts["empty"].format(name=state["name"])
+
+    nav_row = []
+    if has_older:
+        nav_row.append(InlineKeyboardButton(texts["older"], callback_data=encode(HistoryOlder())))
+    if has_newer:
+        nav_row.append(InlineKeyboardButton(texts["newer"], callback_data=encode(HistoryNewer())))
+    buttons = [nav_row] if nav_row else []
+    if state["admin"]:
+        buttons.append([InlineKeyboardButton("🔁 Back to Menu", callback_data=encode(BackToMenu()))])
+        reply_markup = InlineKeyboardMarkup(buttons)
+    else:
+        reply_markup = append_back_button(buttons)
+
+    try:
+        await query.message.edit_text(message, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
@@ -0,0 +1,70 @@
+import random
+import threading
+
+ID_SPACE = 10_000
+PASSWORD_SPACE = 1_000_000
+
+
+class CredentialPool:
+    """Hands out unused 4-digit client IDs and 6-digit passwords without probing the database.
+
+    Free IDs live in a list with a position index, so taking a random one and returning
+    one are both O(1). Passwords come from a space 100x larger than the ID space, so a
+    random draw checked against the in-memory set of used ones succeeds almost always.
+    """
+
+    def __init__(self, id_space=ID_SPACE, password_space=PASSWORD_SPACE):
+        self.id_space = id_space
+        self.password_space = password_space
+        self.loaded = False
+        self._free_ids = []
+        self._position = {}
+        self._used_passwords = set()
+        self._lock = threading.Lock()
+
+    def load(self, used_ids, used_passwords):
+        used_ids = set(used_ids)
+        with self._lock:
+            self._free_ids = [f"{i:04}" for i in range(self.id_space) if f"{i:04}" not in used_ids]
+            self._position = {client_id: i for i, client_id in enumerate(self._free_ids)}
+            self._used_passwords = set(used_passwords)
+            self.loaded = True
+
+    def _remove_id(self, client_id):
+        i = self._position.pop(client_id, None)
+        if i is None:
+            return
+        last = self._free_ids.pop()
+        if last != client_id:
+            self._free_ids[i] = last
+            self._position[last] = i
+
+    def take(self):
+        with self._lock:
+            if not self._free_ids:
+                raise RuntimeError("No free client IDs left")
+            client_id = random.choice(self._free_ids)
+            self._remove_id(client_id)
+            while True:
+                password = f"{random.randrange(self.password_space):06}"
+                if password not in self._used_passwords:
+                    self._used_passwords.add(password)
+                    return client_id, password
+
+    def take_many(self, count):
+        with self._lock:
+            if len(self._free_ids) < count:
+                raise RuntimeError(f"Only {len(self._free_ids)} free client IDs left")
+        return [self.take() for _ in range(count)]
+
+    def mark_used(self, client_id):
+        # Someone else (another process) took this ID first
+        with self._lock:
+            self._remove_id(client_id)
+
+    def release(self, client_id, password=None):
+        with self._lock:
+            if client_id.isdigit() and len(client_id) == 4 and client_id not in self._position:
+                self._position[client_id] = len(self._free_ids)
+                self._free_ids.append(client_id)
+            self._used_passwords.discard(password)
@@ -0,0 +1,126 @@
+from datetime import date, datetime, timedelta
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from schedule import schedule
+from back_utils import append_back_button
+from callbacks import encode, Logout, SlotFull, SlotStarted, DayFull, DayChoice, TimeChoice, SuperDay, SuperTime
+
+DAYS_AHEAD = 30
+
+CLIENT, SUPERUSER = "client", "superuser"
+OPEN, FULL, STARTED = range(3)
+
+
+class KeyboardCache:
+    """Day and time picker keyboards, built once and reused for every button press.
+
+    Day buttons depend only on the calendar day and are rebuilt on the first request after
+    local midnight. Pickers are static apart from the started/full overlay, so each button
+    variant is prebuilt and markups are memoised by the overlay state.
+    """
+
+    def __init__(self, days_ahead=DAYS_AHEAD):
+        self.days_ahead = days_ahead
+        self._built_for = None
+        self.days = []
+        self._day_buttons = {}
+        self._day_pickers = {}
+        self._date_labels = {}
+        self._time_buttons = {
+            (kind, slot.code): self._period_buttons(slot.label, choice)
+            for slot in schedule.slots
+            for kind, choice in ((CLIENT, TimeChoice), (SUPERUSER, SuperTime))
+        }
+        self._time_pickers = {}
+
+    @staticmethod
+    def _period_buttons(label, choice):
+        # Indexed by OPEN, FULL and STARTED
+        return (
+            InlineKeyboardButton(label, callback_data=encode(choice(label))),
+            InlineKeyboardButton(f"⛔ {label}", callback_data=encode(SlotFull())),
+            InlineKeyboardButton(f"⛔ {label}", callback_data=encode(SlotStarted())),
+        )
+
+    def _roll_over(self):
+        today = date.today()
+        if today == self._built_for:
+            return
+        self.days = [today + timedelta(days=i) for i in range(self.days_ahead)]
+        self._day_buttons = {
+            CLIENT: self._build_day_buttons(self.days, "%#d-%b", DayChoice),
+            SUPERUSER: self._build_day_buttons(self.days, "%d-%b", SuperDay),
+        }
+        self._day_pickers = {}
+        self._date_labels = {day: day.strftime("%d/%m/%Y") for day in self.days}
+        self._built_for = today
+
+    @staticmethod
+    def _build_day_buttons(days, label_format, choice):
+        # (open, full) button per day
+        return [
+            (InlineKeyboardButton(label, callback_data=encode(choice(day))),
+             InlineKeyboardButton(f"⛔ {label}", callback_data=encode(DayFull())))
+            for day, label in ((day, day.strftime(label_format)) for day in days)
+        ]
+
+    def window(self):
+        # First and last day offered by the day pickers
+        self._roll_over()
+        return self.days[0], self.days[-1]
+
+    @staticmethod
+    def started_labels(package, now=None):
+        # Periods of the package that can no longer be booked today
+        now = now or datetime.now()
+        return [slot.label for slot in schedule.package_slots(package) if now.time() > slot.start]
+
+    def day_picker(self, kind, package=None, full_days=(), now=None):
+        # full_days: dates on which no period of the package is bookable, as get_full_days
+        # returns when given started_labels() for today. Today is also closed once every
+        # period has started, whatever full_days says.
+        self._roll_over()
+        closed = frozenset(day for day in full_days if day >= self._built_for)
+        if package is not None and len(self.started_labels(package, now)) == len(schedule.package_slots(package)):
+            closed |= {self._built_for}
+
+        markup = self._day_pickers.get((kind, closed))
+        if markup is None:
+            buttons = [pair[day in closed] for day, pair in zip(self.days, self._day_buttons[kind])]
+            rows = [buttons[i:i + 4] for i in range(0, len(buttons), 4)]
+            if kind == CLIENT:
+                rows.append([InlineKeyboardButton("🔒 Выйти", callback_data=encode(Logout()))])
+                markup = append_back_button(rows)
+            else:
+                markup = InlineKeyboardMarkup(rows)
+            self._day_pickers[kind, closed] = markup
+        return markup
+
+    def format_date(self, day):
+        # "%d/%m/%Y" for the dates shown in the day picker, formatted once per day
+        self._roll_over()
+        label = self._date_labels.get(day)
+        return label if label is not None else day.strftime("%d/%m/%Y")
+
+    def time_picker(self, kind, package, day, occupancy, now=None):
+        # occupancy maps (date, period label) -> booked places, as get_occupancy returns
+        now = now or datetime.now()
+        is_today = day == now.date()
+        slots = schedule.package_slots(package)
+        states = tuple(
+            STARTED if is_today and now.time() > slot.start
+            else FULL if occupancy.get((day, slot.label), 0) >= slot.capacity
+            else OPEN
+            for slot in slots
+        )
+        markup = self._time_pickers.get((kind, package, states))
+        if markup is None:
+            buttons = [self._time_buttons[kind, slot.code][state] for slot, state in zip(slots, states)]
+            if kind == CLIENT:
+                markup = append_back_button([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+            else:
+                markup = InlineKeyboardMarkup([[button] for button in buttons])
+            self._time_pickers[kind, package, states] = markup
+        return markup
+
+
+keyboard_cache = KeyboardCache()
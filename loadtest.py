@@ -0,0 +1,291 @@
+"""Load harness: replays synthetic parents through the real handlers.
+
+Builds the Application from main.py with a fake Bot API transport that records every
+outgoing call, drives it at a target rate and reports handler latency percentiles,
+throughput, and database queries and Bot API calls per update.
+
+    python loadtest.py --parents 200 --rate 20
+    python loadtest.py --replay updates.jsonl --rate 50 --json result.json
+
+It needs a PostgreSQL database reachable through the usual DB_* variables (DB_POOL_MAX and
+CONCURRENT_UPDATES apply as in production; DB_TRACE=1 logs each update's SQL trace). Use a scratch database: the run's clients and
+bookings are removed afterwards unless --keep is given, but sequences and statistics move.
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import random
+import statistics
+import time
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+import db
+from tracing import TracingCursor
+
+# Queries issued while handling the current update; asyncio.to_thread copies the context,
+# so the worker threads running db functions see the same counter
+_queries = contextvars.ContextVar("queries", default=None)
+
+
+class CountingCursor(TracingCursor):
+    def execute(self, query, vars=None):
+        counter = _queries.get()
+        if counter is not None:
+            counter[0] += 1
+        return super().execute(query, vars)
+
+
+class FakeBotRequest(BaseRequest):
+    """Answers Bot API calls locally and remembers the last keyboard sent to each chat."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.keyboards = {}
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls += 1
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            chat_id = params.get("chat_id")
+            result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                      "chat": {"id": chat_id or 0, "type": "private"}, "text": params.get("text", "")}
+            markup = params.get("reply_markup")
+            if markup:
+                markup = json.loads(markup) if isinstance(markup, str) else markup
+                result["reply_markup"] = markup
+                self.keyboards[chat_id] = [
+                    button["callback_data"] for row in markup["inline_keyboard"] for button in row
+                    if "callback_data" in button
+                ]
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+_update_ids = itertools.count(1)
+# Synthetic parents get negative user IDs: Telegram only issues positive ones to users, so
+# the run (and its cleanup) can never touch a real user's session in the same database
+SYNTHETIC_USER_BASE = -1_000_000_000
+
+
+def message_update(user_id, text):
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else []
+    return {"update_id": next(_update_ids), "message": {
+        "message_id": next(_update_ids), "date": int(time.time()), "text": text, "entities": entities,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Parent"},
+    }}
+
+
+def callback_update(user_id, data):
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "chat_instance": "load", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Parent"},
+        "message": {"message_id": 1, "date": int(time.time()), "text": "…",
+                    "chat": {"id": user_id, "type": "private"}},
+    }}
+
+
+class Harness:
+    def __init__(self, app, transport):
+        self.app = app
+        self.transport = transport
+        self.samples = []  # (latency seconds, queries, api calls)
+        self.errors = 0
+
+    async def send(self, raw, arrived=None):
+        # Goes through the application's update processor, so per-user ordering and the
+        # concurrency limit apply exactly as in production
+        arrived = arrived or time.perf_counter()
+        update = Update.de_json(raw, self.app.bot)
+        counter = [0]
+
+        async def handle():
+            _queries.set(counter)
+            await self.app.process_update(update)
+
+        calls_before = self.transport.calls
+        await self.app.update_processor.process_update(update, handle())
+        self.samples.append((time.perf_counter() - arrived, counter[0], self.transport.calls - calls_before))
+
+    async def on_error(self, update, context):
+        self.errors += 1
+        logging.getLogger(__name__).debug("Handler error", exc_info=context.error)
+
+    def keyboard(self, user_id, prefix):
+        return [data for data in self.transport.keyboards.get(user_id, []) if data.startswith(prefix)]
+
+
+async def parent_session(harness, user_id, client_id, password, think):
+    # /start → ID → password → visit → day → time → children
+    steps = [
+        lambda: message_update(user_id, "/start"),
+        lambda: message_update(user_id, client_id),
+        lambda: message_update(user_id, password),
+        lambda: callback_update(user_id, (harness.keyboard(user_id, "1v:") or ["1v:1"])[0]),
+        lambda: callback_update(user_id, random.choice(harness.keyboard(user_id, "1d:") or ["1n"])),
+        lambda: callback_update(user_id, random.choice(harness.keyboard(user_id, "1t:") or ["1f"])),
+        lambda: message_update(user_id, str(random.randint(1, 3))),
+    ]
+    for step in steps:
+        await harness.send(step())
+        if think:
+            await asyncio.sleep(random.uniform(0, 2 * think))
+
+
+def synthetic_user_ids(parents):
+    return [SYNTHETIC_USER_BASE - i for i in range(parents)]
+
+
+async def run_parents(harness, parents, rate, think, package):
+    tag = f"Load {int(time.time())}"
+    user_ids = synthetic_user_ids(parents)
+    clients = await db.add_clients_async([(f"{tag} #{i}", "—", 1, package) for i in range(parents)])
+    tasks = []
+    started = time.perf_counter()
+    for i, (client_id, password, _, _) in enumerate(clients):
+        # Parents arrive at a steady `rate` per second
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(parent_session(harness, user_ids[i], client_id, password, think)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started, tag
+
+
+async def run_replay(harness, path, rate):
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    tasks = []
+    started = time.perf_counter()
+    for i, raw in enumerate(updates):
+        arrival = started + i / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(harness.send(raw, arrival)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started
+
+
+def cleanup(tag, user_ids):
+    # Removes the run's clients (active or archived), the sessions of its synthetic users and
+    # the visit logs, and gives their places back to slot_counters
+    with db.get_cursor() as cur:
+        cur.execute("""
+            WITH run_clients AS (
+                SELECT id FROM clients WHERE full_name LIKE %(tag)s
+                UNION ALL SELECT id FROM clients_archive WHERE full_name LIKE %(tag)s
+            ), logs AS (
+                DELETE FROM visit_logs WHERE client_pk IN (SELECT id FROM run_clients)
+                RETURNING visit_date, time_period
+            ), freed AS (
+                SELECT visit_date, time_period, COUNT(*) AS n FROM logs GROUP BY visit_date, time_period
+            )
+            UPDATE slot_counters s SET booked = s.booked - f.n
+            FROM freed f WHERE s.visit_date = f.visit_date AND s.time_period = f.time_period
+        """, {"tag": tag + " #%"})
+        cur.execute("DELETE FROM sessions WHERE telegram_id = ANY(%s)", (user_ids,))
+        cur.execute("DELETE FROM clients WHERE full_name LIKE %s", (tag + " #%",))
+        cur.execute("DELETE FROM clients_archive WHERE full_name LIKE %s", (tag + " #%",))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(harness, elapsed):
+    latencies = [s[0] * 1000 for s in harness.samples]
+    queries = [s[1] for s in harness.samples]
+    calls = [s[2] for s in harness.samples]
+    return {
+        "updates": len(harness.samples),
+        "errors": harness.errors,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(harness.samples) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 2) for p in (50, 95, 99)}
+                      | {"max": round(max(latencies, default=0.0), 2)},
+        "queries_per_update": {"mean": round(statistics.fmean(queries), 2) if queries else 0.0,
+                               "max": max(queries, default=0)},
+        "api_calls_per_update": round(statistics.fmean(calls), 2) if calls else 0.0,
+    }
+
+
+async def main(args):
+    import main as bot
+    from notifier import admin_notifier
+    admin_notifier.token = None  # never reach the real notifier bot
+
+    db.DB_PARAMS["cursor_factory"] = CountingCursor
+    db.init_db()
+    db.ensure_superuser()
+
+    transport = FakeBotRequest(args.api_latency / 1000)
+    app = bot.build_application(
+        ApplicationBuilder().token("1:load").request(transport).get_updates_request(FakeBotRequest())
+    )
+    harness = Harness(app, transport)
+    app.add_error_handler(harness.on_error)
+
+    tag = None
+    async with app:
+        try:
+            if args.replay:
+                elapsed = await run_replay(harness, args.replay, args.rate)
+            else:
+                elapsed, tag = await run_parents(harness, args.parents, args.rate, args.think, args.package)
+            await bot.session_store.flush()
+        finally:
+            if tag and not args.keep:
+                cleanup(tag, synthetic_user_ids(args.parents))
+    db.close_pool()
+
+    result = report(harness, elapsed)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parents", type=int, default=100, help="synthetic parents, each doing one booking")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="parents (or replayed updates) arriving per second")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds a parent waits between taps")
+    parser.add_argument("--package", type=int, default=8, help="package of the generated clients")
+    parser.add_argument("--replay", help="JSON-lines file of raw Telegram updates to replay instead")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency in ms")
+    parser.add_argument("--json", help="also write the result to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the generated clients and bookings")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
@@ -1,4 +1,6 @@
 import os
+import asyncio
+import logging
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -6,30 +8,43 @@ from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     ConversationHandler,
     ContextTypes,
     filters
 )
-from admin import admin_buttons, admin_manual_book, show_available_slots, slot_next, slot_prev, list_clients, get_name, get_children, get_package, admin_cancel, get_phone, NAME, CHILDREN, PACKAGE, PHONE
-from user import client_start, logout_handler, children_input_handler, select_time_handler, full_handler, ignore_handler, select_day_handler, get_client_id, get_client_password, visit_button_handler, client_cancel, LOGIN_ID, LOGIN_PASSWORD
+from admin import admin_buttons, bulk_add_clients, archived_clients, show_stats, find_clients, show_client_card, show_client_visits, admin_manual_book, show_available_slots, slot_next, slot_prev, list_clients, client_page_next, client_page_prev, get_name, get_children, get_package, admin_cancel, get_phone, NAME, CHILDREN, PACKAGE, PHONE
+from user import client_start, logout_handler, children_input_handler, select_time_handler, my_visits_handler, full_handler, day_full_handler, ignore_handler, select_day_handler, get_client_id, get_client_password, visit_button_handler, client_cancel, LOGIN_ID, LOGIN_PASSWORD
 from superuser import start_superuser_flow, handle_superuser_day, handle_superuser_package, handle_superuser_time, ask_superuser_children, handle_superuser_children, SUPER_CHILDREN
-from db import init_db, ensure_superuser, clear_session_keys
-from config import ADMIN_ID, BOT_TOKEN
+from db import init_db, ensure_superuser, close_pool
+from config import ADMIN_ID, BOT_TOKEN, BOT_MODE, CONCURRENT_UPDATES, METRICS_HOST, METRICS_PORT
 from back_utils import append_back_button
+from notifier import admin_notifier
+from session_store import session_store, flush_session
+from update_processor import PerUserUpdateProcessor
+from webhook import run_webhook, check_config as check_webhook_config
+from sweeper import schedule_sweeper
+from profiler import profile_command
+from metrics import ApiCallCounter, instrument, serve as serve_metrics
+from history import history_older, history_newer
+from text_router import text_router, CHILDREN_COUNT, SUPERUSER_CHILDREN
+from callbacks import (
+    CallbackRouter, encode, pattern as callback_pattern, AddClient, ListClients, AvailableSlots,
+    OfflineSuperuser, BackToMenu, Logout, SlotFull, SlotStarted, DayFull, SlotPageNext, SlotPagePrev,
+    ClientPageNext, ClientPagePrev, ClientCard, ClientVisits, MyVisits, HistoryOlder, HistoryNewer, PackageChoice,
+    AdminBook, VisitChoice, DayChoice, TimeChoice, SuperPackage, SuperDay, SuperTime
+)
 
 
-init_db()
-ensure_superuser()
-
 admin_conv = ConversationHandler(
     entry_points=[
-        CallbackQueryHandler(admin_buttons, pattern="^add_client$")
+        CallbackQueryHandler(admin_buttons, pattern=callback_pattern(AddClient))
     ],
     states={
         NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_name)],
         PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_phone)],
         CHILDREN: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_children)],
-        PACKAGE: [CallbackQueryHandler(get_package)],
+        PACKAGE: [CallbackQueryHandler(get_package, pattern=callback_pattern(PackageChoice))],
     },
     fallbacks=[CommandHandler("cancel", admin_cancel)],
     allow_reentry=True,
@@ -45,7 +60,7 @@ client_conv = ConversationHandler(
 )
 
 
-async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
     user_id = update.effective_user.id
 
     # Delete the current inline message to avoid edit errors
@@ -53,10 +68,10 @@ async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if str(user_id) == str(ADMIN_ID):
         keyboard = [
-            [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-            [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-            [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")],
-            [InlineKeyboardButton("📥 Offline Client", callback_data="offline_superuser")]
+            [InlineKeyboardButton("➕ Add Client", callback_data=encode(AddClient()))],
+            [InlineKeyboardButton("📋 List Clients", callback_data=encode(ListClients()))],
+            [InlineKeyboardButton("📊 Available Slots", callback_data=encode(AvailableSlots()))],
+            [InlineKeyboardButton("📥 Offline Client", callback_data=encode(OfflineSuperuser()))]
         ]
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -65,7 +80,8 @@ async def handle_back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
     else:
         # For regular users, clear session and return to login flow
-        clear_session_keys(user_id, ["last_visit", "selected_day", "visit_time"])
+        await session_store.clear_keys(user_id, ["last_visit", "selected_day", "visit_time"])
+        text_router.clear(user_id)
         await client_start(update, context)
 
     return ConversationHandler.END
@@ -79,10 +95,10 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     keyboard = [
-        [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-        [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-        [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")],
-        [InlineKeyboardButton("📥 Offline Client", callback_data="offline_superuser")]
+        [InlineKeyboardButton("➕ Add Client", callback_data=encode(AddClient()))],
+        [InlineKeyboardButton("📋 List Clients", callback_data=encode(ListClients()))],
+        [InlineKeyboardButton("📊 Available Slots", callback_data=encode(AvailableSlots()))],
+        [InlineKeyboardButton("📥 Offline Client", callback_data=encode(OfflineSuperuser()))]
     ]
     await update.message.reply_text("👋 Welcome Admin!", reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -93,54 +109,123 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id == str(ADMIN_ID):
         # Admin: show buttons
         keyboard = [
-            [InlineKeyboardButton("➕ Add Client", callback_data="add_client")],
-            [InlineKeyboardButton("📋 List Clients", callback_data="list_clients")],
-            [InlineKeyboardButton("📊 Available Slots", callback_data="available_slots")],
-            [InlineKeyboardButton("📥 Offline Client", callback_data="offline_superuser")]
+            [InlineKeyboardButton("➕ Add Client", callback_data=encode(AddClient()))],
+            [InlineKeyboardButton("📋 List Clients", callback_data=encode(ListClients()))],
+            [InlineKeyboardButton("📊 Available Slots", callback_data=encode(AvailableSlots()))],
+            [InlineKeyboardButton("📥 Offline Client", callback_data=encode(OfflineSuperuser()))]
         ]
         await update.message.reply_text("👋 Welcome Admin!", reply_markup=InlineKeyboardMarkup(keyboard))
         return 
 
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def on_startup(app):
+    await admin_notifier.start()
+    if METRICS_PORT:
+        app.bot_data["metrics_runner"] = await serve_metrics(METRICS_HOST, METRICS_PORT)
+        logging.getLogger(__name__).info("Metrics served on %s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+
+async def on_shutdown(app):
+    await admin_notifier.stop()
+    if "metrics_runner" in app.bot_data:
+        await app.bot_data.pop("metrics_runner").cleanup()
+    await session_store.flush()
+    close_pool()
+
+
+def build_callback_router():
+    router = CallbackRouter()
+    # Global handlers
+    router.add(BackToMenu, handle_back_to_menu)
+    router.add(OfflineSuperuser, start_superuser_flow)
+    router.add(ListClients, list_clients)
+    router.add(ClientPageNext, client_page_next)
+    router.add(ClientPagePrev, client_page_prev)
+    router.add(ClientCard, show_client_card)
+    router.add(ClientVisits, show_client_visits)
+    router.add(MyVisits, my_visits_handler)
+    router.add(HistoryOlder, history_older)
+    router.add(HistoryNewer, history_newer)
+    router.add(AvailableSlots, show_available_slots)
+    router.add(SlotPageNext, slot_next)
+    router.add(SlotPagePrev, slot_prev)
+    router.add(AdminBook, admin_manual_book)
+
+    # Visit flow (moved outside client_conv)
+    router.add(VisitChoice, visit_button_handler)
+    router.add(DayChoice, select_day_handler)
+    router.add(TimeChoice, select_time_handler)
+
+    # Superuser flow
+    router.add(SuperPackage, handle_superuser_package)
+    router.add(SuperDay, handle_superuser_day)
+    router.add(SuperTime, handle_superuser_time)
+
+    # Shared handlers
+    router.add(SlotFull, full_handler)
+    router.add(SlotStarted, ignore_handler)
+    router.add(DayFull, day_full_handler)
+    router.add(Logout, logout_handler)
+    return router
+
+
+def build_application(builder=None):
+    builder = builder or ApplicationBuilder().token(BOT_TOKEN)
+    # Different users are served in parallel; one user's updates still run in order
+    builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    # Never delays a request; it only counts Bot API calls for the metrics
+    builder = builder.rate_limiter(ApiCallCounter())
+    if BOT_MODE == "webhook":
+        builder = builder.updater(None)
+    app = builder.post_init(on_startup).post_shutdown(on_shutdown).build()
 
     app.add_handler(CommandHandler("admin", admin_start), group=0)
+    app.add_handler(CommandHandler("bulkadd", bulk_add_clients), group=0)
+    app.add_handler(CommandHandler("archived", archived_clients), group=0)
+    app.add_handler(CommandHandler("find", find_clients), group=0)
+    app.add_handler(CommandHandler("stats", show_stats), group=0)
+    app.add_handler(CommandHandler("profile", profile_command), group=0)
       # Admin-only conversation
     app.add_handler(admin_conv, group=0)
 
     # Client login only
     app.add_handler(client_conv, group=0)
-    # Global handlers (group=0)
-    app.add_handler(CallbackQueryHandler(handle_back_to_menu, pattern="^back_to_menu$"), group=0)
-    app.add_handler(CallbackQueryHandler(start_superuser_flow, pattern="^offline_superuser$"), group=0)
-    app.add_handler(CallbackQueryHandler(list_clients, pattern="^list_clients$"), group=0)
-    app.add_handler(CallbackQueryHandler(show_available_slots, pattern="^available_slots$"), group=0)
-    app.add_handler(CallbackQueryHandler(slot_next, pattern="^slot_next$"), group=0)
-    app.add_handler(CallbackQueryHandler(slot_prev, pattern="^slot_prev$"), group=0)
-    app.add_handler(CallbackQueryHandler(admin_manual_book, pattern="^adminbook_"), group=0)
+    # Every other inline button goes through the callback router (group=0)
+    callback_router = build_callback_router()
+    app.add_handler(CallbackQueryHandler(callback_router.dispatch), group=0)
+    # Free-text input outside the conversations goes to whichever handler asked for it
+    text_router.add(CHILDREN_COUNT, children_input_handler)
+    text_router.add(SUPERUSER_CHILDREN, handle_superuser_children)
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_router.dispatch), group=1)
+    app.add_handler(CommandHandler("logout", logout_handler))
 
-    # Visit flow (moved outside client_conv)
-    app.add_handler(CallbackQueryHandler(visit_button_handler, pattern="^visit_"), group=0)
-    app.add_handler(CallbackQueryHandler(select_day_handler, pattern="^day_"), group=0)
-    app.add_handler(CallbackQueryHandler(select_time_handler, pattern="^time_"), group=0)
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, children_input_handler), group=1)
+    # Write back the session changes made while handling the update
+    app.add_handler(TypeHandler(Update, flush_session), group=99)
 
-    # Superuser flow
-    app.add_handler(CallbackQueryHandler(handle_superuser_package, pattern="^super_pkg_"), group=0)
-    app.add_handler(CallbackQueryHandler(handle_superuser_day, pattern="^super_day_"), group=0)
-    app.add_handler(CallbackQueryHandler(handle_superuser_time, pattern="^super_time_"), group=0)
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_superuser_children), group=1)
+    # Latency and error metrics for every handler, including those behind the routers
+    instrument(app, routers=(callback_router, text_router))
 
-    # Shared handlers
-    app.add_handler(CallbackQueryHandler(full_handler, pattern="^full$"), group=0)
-    app.add_handler(CallbackQueryHandler(ignore_handler, pattern="^ignore$"), group=0)
-    app.add_handler(CommandHandler("logout", logout_handler))
-    app.add_handler(CallbackQueryHandler(logout_handler, pattern="^logout$"), group=0)
+    # Expired clients and abandoned sessions are removed in the background
+    schedule_sweeper(app.job_queue)
+    return app
 
 
+def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if BOT_MODE == "webhook":
+        check_webhook_config()
+
+    init_db()
+    ensure_superuser()
+    app = build_application()
+
     print("✅ Bot is running...")
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        # on_startup/on_shutdown are passed explicitly: only run_polling/run_webhook call them
+        asyncio.run(run_webhook(app, on_startup, on_shutdown))
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
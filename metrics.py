@@ -0,0 +1,283 @@
+"""In-process metrics: handler and database latency, errors, queries and Bot API calls per update.
+
+Everything lives in the `metrics` registry below and is rendered in the Prometheus text
+format by render(); serve() exposes it over HTTP and the admin's /stats command summarises it.
+"""
+import contextvars
+import functools
+import math
+import threading
+import time
+import psycopg2.extensions
+from aiohttp import web
+from telegram.ext import BaseRateLimiter, ConversationHandler
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class UpdateStats:
+    __slots__ = ("queries", "api_calls")
+
+    def __init__(self):
+        self.queries = 0
+        self.api_calls = 0
+
+
+# Counters of the update being processed. asyncio.to_thread copies the context, so db
+# functions running on worker threads add to the same object.
+_current = contextvars.ContextVar("update_stats", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Labelled counters and histograms, safe to update from worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = {}  # name -> {label value: Histogram}
+        self.counters = {}  # name -> {label value: number}
+
+    def observe(self, name, value, label=None, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if label not in series:
+                series[label] = Histogram(buckets)
+            series[label].observe(value)
+
+    def inc(self, name, label=None, amount=1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[label] = series.get(label, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {
+                name: {label: (h.buckets, list(h.counts), h.sum, h.count) for label, h in series.items()}
+                for name, series in self.histograms.items()
+            }
+            counters = {name: dict(series) for name, series in self.counters.items()}
+        return histograms, counters
+
+
+metrics = Metrics()
+
+# name -> (help text, label name or None)
+DESCRIPTIONS = {
+    "bot_updates": ("Updates processed", None),
+    "bot_update_seconds": ("Time to process one update, all handlers included", None),
+    "bot_handler_seconds": ("Handler latency", "handler"),
+    "bot_handler_errors": ("Exceptions raised by handlers", "handler"),
+    "bot_db_call_seconds": ("Latency of db.py calls, including the wait for a connection", "function"),
+    "bot_db_errors": ("Exceptions raised by db.py calls", "function"),
+    "bot_db_queries": ("SQL statements executed", None),
+    "bot_queries_per_update": ("SQL statements executed while processing one update", None),
+    "bot_api_calls": ("Bot API requests sent", "method"),
+    "bot_api_calls_per_update": ("Bot API requests sent while processing one update", None),
+}
+
+
+def quantile(buckets, counts, total_count, q):
+    # Upper bound of the bucket holding the q-quantile (inf when beyond the last bucket)
+    seen = 0
+    for bound, count in zip(buckets, counts):
+        seen += count
+        if seen >= q * total_count:
+            return bound
+    return math.inf
+
+
+def _labels(name, label, extra=None):
+    pairs = []
+    key = DESCRIPTIONS.get(name, ("", None))[1]
+    if key and label is not None:
+        pairs.append(f'{key}="{label}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return "+Inf" if value == math.inf else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    histograms, counters = metrics.snapshot()
+    lines = []
+    for name, series in sorted(counters.items()):
+        lines += [f"# HELP {name}_total {DESCRIPTIONS.get(name, ('',))[0]}", f"# TYPE {name}_total counter"]
+        for label, value in sorted(series.items(), key=lambda item: str(item[0])):
+            lines.append(f"{name}_total{_labels(name, label)} {value}")
+    for name, series in sorted(histograms.items()):
+        lines += [f"# HELP {name} {DESCRIPTIONS.get(name, ('',))[0]}", f"# TYPE {name} histogram"]
+        for label, (buckets, counts, total, count) in sorted(series.items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (math.inf,), counts + [count - sum(counts)]):
+                cumulative += bucket_count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{name}_bucket{_labels(name, label, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(name, label)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(name, label)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class MeteredCursor(psycopg2.extensions.cursor):
+    # Used for every pooled connection (db.DB_PARAMS); counts statements per update
+    def execute(self, query, vars=None):
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+        metrics.inc("bot_db_queries")
+        return super().execute(query, vars)
+
+
+class ApiCallCounter(BaseRateLimiter):
+    """Counts outbound Bot API requests; it never delays them."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        stats = _current.get()
+        if stats is not None:
+            stats.api_calls += 1
+        metrics.inc("bot_api_calls", endpoint)
+        return await callback(*args, **kwargs)
+
+
+async def observe_update(coroutine):
+    stats = UpdateStats()
+    _current.set(stats)
+    started = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        metrics.observe("bot_update_seconds", time.perf_counter() - started)
+        metrics.observe("bot_queries_per_update", stats.queries, buckets=COUNT_BUCKETS)
+        metrics.observe("bot_api_calls_per_update", stats.api_calls, buckets=COUNT_BUCKETS)
+        metrics.inc("bot_updates")
+
+
+def observe_handler(handler):
+    # Idempotent: module-level handlers (the conversations, the text router) are seen again
+    # whenever an application is built, and must not be measured twice
+    if getattr(handler, "observed", False):
+        return handler
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            metrics.inc("bot_handler_errors", name)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - started, name)
+    wrapper.observed = True
+    return wrapper
+
+
+def observe_db(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            metrics.inc("bot_db_errors", name)
+            raise
+        finally:
+            metrics.observe("bot_db_call_seconds", time.perf_counter() - started, name)
+    return wrapper
+
+
+def instrument(app, routers=()):
+    # Wraps the callback of every registered handler. The routers' dispatch methods are left
+    # alone and the handlers registered with them are wrapped instead, so each shows by name.
+    def visit(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks:
+                visit(inner)
+            for handlers in handler.states.values():
+                for inner in handlers:
+                    visit(inner)
+            return
+        router = getattr(handler.callback, "__self__", None)
+        if router in routers:
+            router.wrap(observe_handler)
+        else:
+            handler.callback = observe_handler(handler.callback)
+
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            visit(handler)
+
+
+def summary(limit=8):
+    # Text for the admin's /stats command: the handlers and db calls taking the most time
+    histograms, counters = metrics.snapshot()
+    uptime = int(time.time() - metrics.started)
+    updates = counters.get("bot_updates", {}).get(None, 0)
+    lines = [f"📈 Stats for the last {uptime // 3600}h {uptime % 3600 // 60}m — {updates} updates"]
+
+    def per_update(name):
+        series = histograms.get(name, {}).get(None)
+        return f"{series[2] / series[3]:.1f}" if series and series[3] else "—"
+    lines.append(f"🗄 {per_update('bot_queries_per_update')} queries and "
+                 f"📨 {per_update('bot_api_calls_per_update')} API calls per update")
+
+    def top(name, errors, title):
+        series = histograms.get(name, {})
+        failed = counters.get(errors, {})
+        ranked = sorted(series.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        if not ranked:
+            return
+        lines.append(f"\n{title} (calls · mean · p95 · total · errors):")
+        for label, (buckets, counts, total, count) in ranked:
+            p95 = quantile(buckets, counts, count, 0.95)
+            p95 = f"≤{p95 * 1000:g} ms" if p95 != math.inf else f">{buckets[-1]:g} s"
+            lines.append(f"• {label}: {count} · {total / count * 1000:.1f} ms · {p95} · "
+                         f"{total:.1f} s · {failed.get(label, 0)}")
+
+    top("bot_handler_seconds", "bot_handler_errors", "⏱ Handlers")
+    top("bot_db_call_seconds", "bot_db_errors", "🗄 Database calls")
+    return "\n".join(lines)
+
+
+async def serve(host, port):
+    # Starts the Prometheus endpoint (GET /metrics) and returns its runner, for cleanup()
+    async def handle(request):
+        return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
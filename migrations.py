@@ -0,0 +1,240 @@
+import psycopg2
+from datetime import date
+from schedule import schedule
+from partitions import MONTHS_AHEAD, month_start, add_months, create_partitions
+
+# Normalised forms of clients.full_name and clients.phone that /find searches and indexes
+SEARCH_NAME = "(lower(full_name))"
+SEARCH_PHONE = "(regexp_replace(phone, '\\D', '', 'g'))"
+
+# Arbitrary key for pg_advisory_xact_lock so two bot instances never migrate at once
+MIGRATION_LOCK_ID = 7_420_001
+
+
+def _seed_slot_counters(cur):
+    # Counters for bookings made before slot_counters existed
+    cur.execute("""
+        INSERT INTO slot_counters (visit_date, time_period, capacity, booked)
+        SELECT l.visit_date, l.time_period, COALESCE(c.capacity, %s), COUNT(*)
+        FROM visit_logs l
+        LEFT JOIN unnest(%s::text[], %s::int[]) AS c(time_period, capacity)
+            ON c.time_period = l.time_period
+        WHERE l.visit_date IS NOT NULL AND l.time_period IS NOT NULL
+        GROUP BY l.visit_date, l.time_period, c.capacity
+        ON CONFLICT DO NOTHING
+    """, (schedule.default_capacity, [s.label for s in schedule.slots], [s.capacity for s in schedule.slots]))
+
+
+def _partition_visit_logs(cur):
+    # Rebuild visit_logs as a table partitioned by month and move the existing rows over
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = 'visit_logs'::regclass")
+    if cur.fetchone()[0] == "p":
+        return
+    cur.execute("ALTER TABLE visit_logs RENAME TO visit_logs_unpartitioned")
+    cur.execute("ALTER SEQUENCE visit_logs_id_seq OWNED BY NONE")
+    for index in ("visit_logs_date_period_idx", "visit_logs_client_id_idx", "visit_logs_client_pk_idx"):
+        cur.execute(f"DROP INDEX IF EXISTS {index}")
+    cur.execute("""
+        CREATE TABLE visit_logs (
+            id INTEGER NOT NULL DEFAULT nextval('visit_logs_id_seq'),
+            client_id TEXT,
+            client_pk INTEGER,
+            visit_number INTEGER,
+            visit_date DATE NOT NULL,
+            time_period TEXT NOT NULL,
+            PRIMARY KEY (id, visit_date)
+        ) PARTITION BY RANGE (visit_date)
+    """)
+    cur.execute("ALTER SEQUENCE visit_logs_id_seq OWNED BY visit_logs.id")
+
+    cur.execute("SELECT MIN(visit_date) FROM visit_logs_unpartitioned")
+    first = cur.fetchone()[0] or date.today()
+    create_partitions(cur, first, add_months(month_start(date.today()), MONTHS_AHEAD))
+    cur.execute("SELECT MAX(visit_date) FROM visit_logs_unpartitioned")
+    last = cur.fetchone()[0]
+    if last:
+        create_partitions(cur, first, last)
+
+    cur.execute("""
+        WITH moved AS (
+            DELETE FROM visit_logs_unpartitioned
+            WHERE visit_date IS NOT NULL AND time_period IS NOT NULL
+            RETURNING id, client_id, client_pk, visit_number, visit_date, time_period
+        )
+        INSERT INTO visit_logs (id, client_id, client_pk, visit_number, visit_date, time_period)
+        SELECT * FROM moved
+    """)
+    # Rows without a date or period cannot be partitioned; keep them aside if there are any
+    cur.execute("SELECT EXISTS (SELECT 1 FROM visit_logs_unpartitioned)")
+    if not cur.fetchone()[0]:
+        cur.execute("DROP TABLE visit_logs_unpartitioned")
+
+
+def _create_search_indexes(cur):
+    # Prefix lookups always get a btree; substring lookups need pg_trgm, which not every
+    # server ships, so its absence only costs speed (see db.find_clients)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS clients_name_prefix_idx ON clients ({SEARCH_NAME} text_pattern_ops)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS clients_phone_prefix_idx ON clients ({SEARCH_PHONE} text_pattern_ops)")
+    # Phones are usually searched by their last digits; a reversed prefix index serves that
+    cur.execute(f"CREATE INDEX IF NOT EXISTS clients_phone_suffix_idx ON clients (reverse{SEARCH_PHONE} text_pattern_ops)")
+    cur.execute("SAVEPOINT pg_trgm")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT pg_trgm")
+        return
+    cur.execute(f"CREATE INDEX IF NOT EXISTS clients_name_trgm_idx ON clients USING gin ({SEARCH_NAME} gin_trgm_ops)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS clients_phone_trgm_idx ON clients USING gin ({SEARCH_PHONE} gin_trgm_ops)")
+
+
+# (version, description, steps) — a step is an SQL string or a callable taking the cursor.
+# Every step must be idempotent: databases created before versioning already have
+# some of these objects. Never edit an applied migration; append a new one.
+MIGRATIONS = [
+    (1, "create clients, visit_logs and sessions", [
+        """
+        CREATE TABLE IF NOT EXISTS clients (
+            id SERIAL PRIMARY KEY,
+            client_id TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            full_name TEXT,
+            phone TEXT,
+            children_count INTEGER,
+            package_type TEXT,
+            visits_remaining INTEGER,
+            start_date DATE,
+            expire_date DATE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS visit_logs (
+            id SERIAL PRIMARY KEY,
+            client_id TEXT,
+            visit_number INTEGER,
+            visit_date DATE,
+            time_period TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            telegram_id BIGINT PRIMARY KEY,
+            client_id TEXT NOT NULL,
+            login_time TIMESTAMP DEFAULT NOW()
+        )
+        """,
+    ]),
+    (2, "add sessions.data", [
+        "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS data JSONB DEFAULT '{}'",
+    ]),
+    (3, "create slot_counters", [
+        """
+        CREATE TABLE IF NOT EXISTS slot_counters (
+            visit_date DATE NOT NULL,
+            time_period TEXT NOT NULL,
+            capacity INTEGER NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (visit_date, time_period)
+        )
+        """,
+        _seed_slot_counters,
+    ]),
+    (4, "index visit_logs, clients.password and sessions.client_id", [
+        "CREATE INDEX IF NOT EXISTS visit_logs_date_period_idx ON visit_logs (visit_date, time_period)",
+        "CREATE INDEX IF NOT EXISTS visit_logs_client_id_idx ON visit_logs (client_id)",
+        "CREATE INDEX IF NOT EXISTS clients_password_idx ON clients (password)",
+        "CREATE INDEX IF NOT EXISTS sessions_client_id_idx ON sessions (client_id)",
+    ]),
+    (5, "track session activity for the expiry sweeper", [
+        "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()",
+        "CREATE INDEX IF NOT EXISTS clients_expire_date_idx ON clients (expire_date)",
+    ]),
+    (6, "archive finished clients; link visit_logs to the client row", [
+        """
+        CREATE TABLE IF NOT EXISTS clients_archive (
+            id INTEGER PRIMARY KEY,
+            client_id TEXT NOT NULL,
+            full_name TEXT,
+            phone TEXT,
+            children_count INTEGER,
+            package_type TEXT,
+            visits_remaining INTEGER,
+            start_date DATE,
+            expire_date DATE,
+            reason TEXT NOT NULL,
+            archived_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS clients_archive_client_id_idx ON clients_archive (client_id)",
+        "CREATE INDEX IF NOT EXISTS clients_archive_archived_at_idx ON clients_archive (archived_at)",
+        # Client IDs are reused once released, so logs point at the row id instead
+        "ALTER TABLE visit_logs ADD COLUMN IF NOT EXISTS client_pk INTEGER",
+        # Logs from before the current holder's start date belong to a deleted former holder
+        # of the same ID; they keep client_pk NULL
+        """
+        UPDATE visit_logs l SET client_pk = c.id
+        FROM clients c
+        WHERE c.client_id = l.client_id AND l.visit_date >= c.start_date AND l.client_pk IS NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS visit_logs_client_pk_idx ON visit_logs (client_pk)",
+    ]),
+    (7, "partition visit_logs by month; add the visit_log_daily rollup", [
+        _partition_visit_logs,
+        "CREATE INDEX IF NOT EXISTS visit_logs_date_period_idx ON visit_logs (visit_date, time_period)",
+        "CREATE INDEX IF NOT EXISTS visit_logs_client_id_idx ON visit_logs (client_id)",
+        "CREATE INDEX IF NOT EXISTS visit_logs_client_pk_idx ON visit_logs (client_pk)",
+        """
+        CREATE TABLE IF NOT EXISTS visit_log_daily (
+            visit_date DATE NOT NULL,
+            time_period TEXT NOT NULL,
+            visits INTEGER NOT NULL,
+            PRIMARY KEY (visit_date, time_period)
+        )
+        """,
+    ]),
+    (8, "index clients for the keyset-paginated admin list", [
+        "CREATE INDEX IF NOT EXISTS clients_name_keyset_idx ON clients ((COALESCE(full_name, '')), client_id)",
+    ]),
+    (9, "index client names and phone digits for /find", [
+        _create_search_indexes,
+    ]),
+    (10, "index visit_logs for per-client visit history", [
+        "CREATE INDEX IF NOT EXISTS visit_logs_client_pk_date_idx ON visit_logs (client_pk, visit_date, id)",
+        # Covered by the index above
+        "DROP INDEX IF EXISTS visit_logs_client_pk_idx",
+    ]),
+]
+
+
+def apply_migrations(cur):
+    # Runs inside the caller's transaction, so a failing migration leaves no partial schema
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    if cur.fetchone()[0] >= MIGRATIONS[-1][0]:
+        return []
+
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+    # Re-read under the lock: another instance may have migrated meanwhile
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    current = cur.fetchone()[0]
+
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        for step in steps:
+            if callable(step):
+                step(cur)
+            else:
+                cur.execute(step)
+        cur.execute(
+            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+            (version, description)
+        )
+        applied.append(version)
+    return applied
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+import httpx
+from config import (
+    ADMIN_ID, NOTIFIER_BOT_TOKEN, NOTIFIER_API_URL, NOTIFY_DIGEST_SECONDS,
+    NOTIFY_TIMEOUT, NOTIFY_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram allows roughly one message per second into a single chat
+MIN_SEND_INTERVAL = 1.0
+_STOP = object()
+
+
+class AdminNotifier:
+    """Delivers admin notifications from a background task so handlers never wait on HTTP.
+
+    With digest_window > 0, messages queued within that many seconds of the first
+    one are merged into a single Telegram message.
+    """
+
+    def __init__(self, token, chat_id, base_url="https://api.telegram.org", digest_window=0.0,
+                 timeout=10.0, max_retries=5):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url.rstrip("/")
+        self.digest_window = digest_window
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._queue = None
+        self._task = None
+        self._client = None
+        self._last_sent = 0.0
+
+    def notify(self, text):
+        if not self.token:
+            return
+        if self._queue is None:
+            logger.warning("Notifier not started, dropping: %s", text)
+            return
+        self._queue.put_nowait(text)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Everything queued before stop() is still delivered
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        await self._client.aclose()
+        self._task = self._queue = self._client = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            if self.digest_window > 0:
+                deadline = time.monotonic() + self.digest_window
+                while (remaining := deadline - time.monotonic()) > 0:
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+            for text in self._compose(batch):
+                await self._send(text)
+
+    def _compose(self, batch):
+        if len(batch) == 1:
+            return batch
+        header = f"📢 {len(batch)} new notifications\n\n"
+        messages, current = [], header
+        for text in batch:
+            if len(current) + len(text) + 2 > TELEGRAM_MESSAGE_LIMIT and current != header:
+                messages.append(current.rstrip())
+                current = ""
+            current += text + "\n\n"
+        messages.append(current.rstrip())
+        return messages
+
+    async def _send(self, text):
+        url = f"{self.base_url}/bot{self.token}/sendMessage"
+        payload = {"chat_id": self.chat_id, "text": text[:TELEGRAM_MESSAGE_LIMIT]}
+        for attempt in range(self.max_retries):
+            wait = self._last_sent + MIN_SEND_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            delay = 2 ** attempt
+            try:
+                response = await self._client.post(url, json=payload)
+            except httpx.HTTPError as e:
+                logger.warning("Admin notification failed (attempt %d): %s", attempt + 1, e)
+            else:
+                self._last_sent = time.monotonic()
+                if response.is_success:
+                    return True
+                if response.status_code == 429:
+                    # Flood control: Telegram says exactly how long to back off
+                    try:
+                        delay = response.json()["parameters"]["retry_after"]
+                    except (ValueError, KeyError, TypeError):
+                        pass
+                elif response.status_code < 500:
+                    logger.error("Admin notification rejected (%d): %s", response.status_code, response.text)
+                    return False
+                logger.warning("Admin notification failed (attempt %d): HTTP %d", attempt + 1, response.status_code)
+            await asyncio.sleep(delay)
+        logger.error("Admin notification dropped after %d attempts: %s", self.max_retries, text)
+        return False
+
+
+admin_notifier = AdminNotifier(
+    NOTIFIER_BOT_TOKEN, ADMIN_ID,
+    base_url=NOTIFIER_API_URL,
+    digest_window=NOTIFY_DIGEST_SECONDS,
+    timeout=NOTIFY_TIMEOUT,
+    max_retries=NOTIFY_MAX_RETRIES,
+)
@@ -0,0 +1,69 @@
+from datetime import date
+
+# visit_logs is range-partitioned by visit_date into one table per month, visit_logs_pYYYYMM.
+# Bookings reach at most 30 days ahead, so the current month plus two is always enough.
+MONTHS_AHEAD = 2
+PREFIX = "visit_logs_p"
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PREFIX}{month.year:04}{month.month:02}"
+
+
+def list_partitions(cur):
+    # Month -> partition name for every existing monthly partition
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visit_logs'::regclass
+    """)
+    months = {}
+    for (name,) in cur.fetchall():
+        suffix = name[len(PREFIX):]
+        if name.startswith(PREFIX) and len(suffix) == 6 and suffix.isdigit():
+            months[date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return months
+
+
+def create_partitions(cur, first_month, last_month):
+    # Creates the missing monthly partitions in [first_month, last_month]; returns their names
+    existing = list_partitions(cur)
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            name = partition_name(month)
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF visit_logs
+                FOR VALUES FROM (%s) TO (%s)
+            """, (month, add_months(month, 1)))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def drop_expired_partitions(cur, keep_months, today=None):
+    # Rolls the partitions entirely older than keep_months up into visit_log_daily, then drops them
+    cutoff = add_months(month_start(today or date.today()), -keep_months)
+    dropped = []
+    for month, name in sorted(list_partitions(cur).items()):
+        if month >= cutoff:
+            break
+        cur.execute(f"""
+            INSERT INTO visit_log_daily (visit_date, time_period, visits)
+            SELECT visit_date, time_period, COUNT(*) FROM {name}
+            GROUP BY visit_date, time_period
+            ON CONFLICT (visit_date, time_period) DO UPDATE SET visits = EXCLUDED.visits
+        """)
+        cur.execute(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
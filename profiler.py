@@ -0,0 +1,157 @@
+import asyncio
+import cProfile
+import html
+import logging
+import os
+import pstats
+import tempfile
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes
+from config import ADMIN_ID
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS = 30
+# A profile never runs longer than this, even when it waits for a number of updates
+MAX_SECONDS = 600
+MAX_UPDATES = 10_000
+TOP_FUNCTIONS = 20
+# Telegram's limit for document captions; longer summaries are sent as their own message
+CAPTION_LIMIT = 1024
+
+USAGE = (
+    "Usage: /profile [seconds]s | /profile <updates> | /profile stop\n"
+    "e.g. /profile 30s profiles the next 30 seconds, /profile 100 the next 100 updates."
+)
+
+
+def _is_loop_internal(filename):
+    return filename == "~" or f"{os.sep}asyncio{os.sep}" in filename or filename.endswith(f"{os.sep}selectors.py")
+
+
+class ProfileSession:
+    """One cProfile run over the event loop thread, ended by time, an update count or /profile stop.
+
+    Handlers of every user run on the event loop, so they are all profiled; blocking db calls
+    run on worker threads and show up as the time spent awaiting them.
+    """
+
+    def __init__(self, bot, chat_id, started_by, updates=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.started_by = started_by
+        self.updates = updates
+        self.seen = 0
+        self.started = datetime.now()
+        self.profile = cProfile.Profile()
+        self.timeout = None
+        self.finishing = False
+
+    def start(self, seconds):
+        self.profile.enable()
+        self.timeout = asyncio.get_running_loop().call_later(seconds, self.stop)
+
+    def update_processed(self, update):
+        if self.updates is None or getattr(update, "update_id", None) == self.started_by:
+            return
+        self.seen += 1
+        if self.seen >= self.updates:
+            self.stop()
+
+    def stop(self):
+        if self.finishing:
+            return
+        self.finishing = True
+        self.profile.disable()
+        self.timeout.cancel()
+        asyncio.get_running_loop().create_task(self.report())
+
+    async def report(self):
+        global _session
+        path = os.path.join(tempfile.gettempdir(), f"profile-{self.started:%Y%m%d-%H%M%S}.prof")
+        try:
+            self.profile.dump_stats(path)
+            summary = self.summary((datetime.now() - self.started).total_seconds())
+            with open(path, "rb") as f:
+                if len(summary) <= CAPTION_LIMIT:
+                    await self.bot.send_document(
+                        self.chat_id, f, filename=os.path.basename(path), caption=summary, parse_mode="HTML"
+                    )
+                else:
+                    await self.bot.send_message(self.chat_id, summary, parse_mode="HTML")
+                    await self.bot.send_document(self.chat_id, f, filename=os.path.basename(path))
+        except Exception:
+            logger.exception("Could not send the profile")
+        finally:
+            _session = None
+            if os.path.exists(path):
+                os.remove(path)
+
+    def summary(self, elapsed):
+        stats = pstats.Stats(self.profile).stats
+        # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        # The event loop's own frames (and builtins such as epoll) span everything; leave them out
+        ranked = sorted(
+            (item for item in stats.items() if not _is_loop_internal(item[0][0])),
+            key=lambda item: item[1][3], reverse=True
+        )[:TOP_FUNCTIONS]
+        updates = f", {self.seen} updates" if self.updates is not None else ""
+        lines = [f"{'cum s':>8} {'calls':>7}  function"]
+        for (filename, line, function), (_, calls, _, cumulative, _) in ranked:
+            where = f"{os.path.basename(filename)}:{line}" if line else filename
+            lines.append(f"{cumulative:8.3f} {calls:>7}  {function} ({where})")
+        return (
+            f"🔬 <b>Profile of {elapsed:.1f} s{updates}</b> — top {len(ranked)} by cumulative time\n"
+            f"<pre>{html.escape(chr(10).join(lines))}</pre>"
+        )
+
+
+_session = None
+
+
+def update_processed(update):
+    # Called by the update processor after every update
+    if _session is not None:
+        _session.update_processed(update)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _session
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        await update.message.reply_text("🚫 You are not authorized.")
+        return
+
+    arg = context.args[0].lower() if context.args else f"{DEFAULT_SECONDS}s"
+    if arg == "stop":
+        if _session is None:
+            await update.message.reply_text("ℹ️ No profile is running.")
+        else:
+            _session.stop()
+        return
+    if _session is not None:
+        await update.message.reply_text("⏳ A profile is already running. Send /profile stop to end it now.")
+        return
+
+    seconds, updates = MAX_SECONDS, None
+    try:
+        if arg.endswith("s"):
+            seconds = int(arg[:-1])
+            if not 0 < seconds <= MAX_SECONDS:
+                raise ValueError
+        else:
+            updates = int(arg)
+            if not 0 < updates <= MAX_UPDATES:
+                raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"{USAGE}\nAt most {MAX_SECONDS} seconds or {MAX_UPDATES} updates.")
+        return
+
+    _session = ProfileSession(context.bot, update.effective_chat.id, update.update_id, updates)
+    _session.start(seconds)
+    if updates is None:
+        await update.message.reply_text(f"🔬 Profiling the next {seconds} seconds…")
+    else:
+        await update.message.reply_text(
+            f"🔬 Profiling the next {updates} updates (at most {MAX_SECONDS // 60} minutes)…"
+        )
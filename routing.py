@@ -0,0 +1,12 @@
+class HandlerTable:
+    """Handlers registered under a key; the base of the callback and text routers."""
+
+    def __init__(self):
+        self._handlers = {}
+
+    def add(self, key, handler):
+        self._handlers[key] = handler
+
+    def wrap(self, decorator):
+        # Replaces every registered handler with decorator(handler), e.g. to instrument it
+        self._handlers = {key: decorator(handler) for key, handler in self._handlers.items()}
@@ -0,0 +1,61 @@
+from datetime import time
+from typing import NamedTuple
+from config import PACKAGES, DEFAULT_CAPACITY
+
+
+class Slot(NamedTuple):
+    code: str        # "0811" — what callback data carries
+    label: str       # "08:00–11:00" — what visit_logs and slot_counters store
+    start: time
+    end: time
+    capacity: int
+    package: int
+
+
+def _parse_time(text):
+    hours, minutes = text.split(":")
+    return time(int(hours), int(minutes))
+
+
+class Schedule:
+    """Packages, their time periods and slot capacities, compiled once into lookup tables.
+
+    Handlers, keyboards, callback encoding and the admin report all read from the same
+    tables instead of keeping their own copies of the period strings.
+    """
+
+    def __init__(self, packages, default_capacity=DEFAULT_CAPACITY):
+        self.default_capacity = default_capacity
+        self.packages = tuple(packages)
+        self.by_label = {}
+        self.by_code = {}
+        self._by_package = {}
+        self._labels_by_package = {}
+        for package, spec in packages.items():
+            slots = []
+            for label in spec["periods"]:
+                start, end = label.split("–")
+                slot = Slot(start[:2] + end[:2], label, _parse_time(start), _parse_time(end),
+                            spec["capacity"], package)
+                if label in self.by_label or slot.code in self.by_code:
+                    other = (self.by_label.get(label) or self.by_code[slot.code]).package
+                    raise ValueError(f"Period {label} of package {package} clashes with package {other}")
+                self.by_label[label] = self.by_code[slot.code] = slot
+                slots.append(slot)
+            self._by_package[package] = tuple(slots)
+            self._labels_by_package[package] = [slot.label for slot in slots]
+        self.slots = tuple(self.by_label.values())
+
+    def package_slots(self, package):
+        # Unknown packages get the periods of the last one, as the old if/elif chains did
+        return self._by_package.get(package) or self._by_package[self.packages[-1]]
+
+    def package_labels(self, package):
+        return self._labels_by_package.get(package) or self._labels_by_package[self.packages[-1]]
+
+    def capacity(self, label):
+        slot = self.by_label.get(label)
+        return slot.capacity if slot else self.default_capacity
+
+
+schedule = Schedule(PACKAGES)
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import OrderedDict
+from config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL
+from db import load_session_async, save_session_async, delete_session_async
+
+
+class _Entry:
+    __slots__ = ("client_id", "data", "dirty", "removed", "client_dirty", "loaded_at")
+
+    def __init__(self, client_id, data):
+        self.client_id = client_id
+        self.data = data
+        self.dirty = set()
+        self.removed = set()
+        self.client_dirty = False
+        self.loaded_at = time.monotonic()
+
+    @property
+    def is_dirty(self):
+        return bool(self.dirty or self.removed or self.client_dirty)
+
+
+class SessionStore:
+    """In-memory view of the sessions table, keyed by telegram_id.
+
+    Reads are served from memory after the first load; writes only touch memory and
+    are written back by flush() as one upsert per session. Clean entries are
+    evicted least-recently-used first and reloaded once older than the TTL.
+    """
+
+    def __init__(self, max_entries=1000, ttl=900.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    async def _entry(self, telegram_id):
+        entry = self._entries.get(telegram_id)
+        if entry is not None and (entry.is_dirty or time.monotonic() - entry.loaded_at < self.ttl):
+            self._entries.move_to_end(telegram_id)
+            return entry
+
+        # Concurrent first reads for the same user share one query
+        pending = self._loading.get(telegram_id)
+        if pending is None:
+            pending = asyncio.ensure_future(load_session_async(telegram_id))
+            self._loading[telegram_id] = pending
+            try:
+                row = await pending
+            finally:
+                self._loading.pop(telegram_id, None)
+            client_id, data = row if row else (None, {})
+            entry = _Entry(client_id, data or {})
+            self._entries[telegram_id] = entry
+            await self._evict()
+            return entry
+        await pending
+        return self._entries.get(telegram_id) or await self._entry(telegram_id)
+
+    async def _evict(self):
+        while len(self._entries) > self.max_entries:
+            telegram_id, entry = next(iter(self._entries.items()))
+            if entry.is_dirty:
+                await self.flush(telegram_id)
+                if self._entries.get(telegram_id) is not entry:
+                    continue  # dropped or replaced while flushing
+                if entry.is_dirty:
+                    # Written to while flushing: keep it, it goes out with that update's flush
+                    self._entries.move_to_end(telegram_id)
+                    continue
+            del self._entries[telegram_id]
+
+    async def get(self, telegram_id, key):
+        return (await self._entry(telegram_id)).data.get(key)
+
+    async def get_many(self, telegram_id, *keys):
+        data = (await self._entry(telegram_id)).data
+        return tuple(data.get(key) for key in keys)
+
+    async def get_client_id(self, telegram_id):
+        return (await self._entry(telegram_id)).client_id
+
+    async def set(self, telegram_id, key, value):
+        await self.set_many(telegram_id, **{key: value})
+
+    async def set_many(self, telegram_id, **values):
+        entry = await self._entry(telegram_id)
+        entry.data.update(values)
+        entry.dirty.update(values)
+        entry.removed.difference_update(values)
+
+    async def bind(self, telegram_id, client_id):
+        entry = await self._entry(telegram_id)
+        entry.client_id = client_id
+        entry.client_dirty = True
+
+    async def clear_keys(self, telegram_id, keys):
+        entry = await self._entry(telegram_id)
+        for key in keys:
+            entry.data.pop(key, None)
+            entry.dirty.discard(key)
+            entry.removed.add(key)
+
+    async def delete(self, telegram_id):
+        self._entries.pop(telegram_id, None)
+        await delete_session_async(telegram_id)
+
+    def invalidate_client(self, client_id):
+        # The client row is gone and the database already dropped its sessions
+        for telegram_id in [t for t, e in self._entries.items() if e.client_id == client_id]:
+            del self._entries[telegram_id]
+
+    async def flush(self, telegram_id=None):
+        ids = [telegram_id] if telegram_id is not None else list(self._entries)
+        for tid in ids:
+            entry = self._entries.get(tid)
+            if entry is None or not entry.is_dirty:
+                continue
+            updates = {key: entry.data[key] for key in entry.dirty}
+            removed = list(entry.removed)
+            client_id = entry.client_id if entry.client_dirty else None
+            entry.dirty, entry.removed, entry.client_dirty = set(), set(), False
+            try:
+                await save_session_async(tid, client_id, updates, removed)
+            except BaseException:
+                # Keep the changes so the next flush retries them
+                entry.dirty.update(k for k in updates if k in entry.data)
+                entry.removed.update(removed)
+                entry.client_dirty = entry.client_dirty or client_id is not None
+                raise
+
+
+session_store = SessionStore(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+
+async def flush_session(update, context):
+    # Registered in the last handler group: one write-back per processed update
+    if update.effective_user:
+        await session_store.flush(update.effective_user.id)
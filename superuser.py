@@ -1,104 +1,67 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from datetime import datetime, timedelta
-from db import count_bookings_for_period, conn
+from db import get_occupancy_async, get_full_days_async, log_visit_async
 from config import SUPERUSER_ID, SUPERUSER_PASSWORD
+from text_router import text_router, SUPERUSER_CHILDREN
+from schedule import schedule
+from keyboards import keyboard_cache, SUPERUSER
+from callbacks import encode, SuperPackage, SuperDay, SuperTime
 
-MAX_CAPACITY = {
-    8: 15,
-    10: 10,
-    12: 5
-}
 SUPER_CHILDREN = 101  
 
-async def start_superuser_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def start_superuser_flow(update: Update, context: ContextTypes.DEFAULT_TYPE, payload=None):
     query = update.callback_query
     await query.answer()
 
     context.user_data["client_id"] = SUPERUSER_ID
     context.user_data["password"] = SUPERUSER_PASSWORD
     context.user_data["visit_number"] = 1
+    text_router.expect(update.effective_user.id, SUPERUSER_CHILDREN)
 
     await query.message.edit_text("👶 Enter number of children:")
     return SUPER_CHILDREN
 
 
-async def handle_superuser_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    package_type = int(update.callback_query.data.split("_")[2])
+async def handle_superuser_package(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: SuperPackage):
+    package_type = payload.package
     context.user_data["package"] = package_type
     await update.callback_query.answer()
 
-    today = datetime.today()
-    buttons = []
-    row = []
-    for i in range(30):
-        date = today + timedelta(days=i)
-        label = date.strftime("%d-%b")
-        callback_data = f"super_day_{date.strftime('%Y-%m-%d')}"
-        row.append(InlineKeyboardButton(label, callback_data=callback_data))
-        if len(row) == 4:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-
+    first_day, last_day = keyboard_cache.window()
+    full_days = await get_full_days_async(
+        first_day, last_day, schedule.package_labels(package_type), keyboard_cache.started_labels(package_type)
+    )
     await update.callback_query.message.edit_text(
-        "📅 Select a day for Visit 1:", reply_markup=InlineKeyboardMarkup(buttons)
+        "📅 Select a day for Visit 1:",
+        reply_markup=keyboard_cache.day_picker(SUPERUSER, package_type, full_days),
     )
 
 
-async def handle_superuser_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    selected_date = update.callback_query.data.split("_")[2]
-    date_obj = datetime.strptime(selected_date, "%Y-%m-%d").date()
+async def handle_superuser_day(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: SuperDay):
+    date_obj = payload.date
     context.user_data["date"] = date_obj
 
     package = context.user_data["package"]
-    if package == 8:
-        periods = ["08:00–11:00", "11:00–14:00", "14:00–17:00", "17:00–20:00"]
-    elif package == 10:
-        periods = ["08:00–12:00", "12:00–16:00", "16:00–20:00"]
-    else:
-        periods = ["08:00–14:00", "14:00–20:00"]
-
-    now = datetime.now()
-    is_today = (date_obj == now.date())
-    max_allowed = MAX_CAPACITY.get(package, 10)
-
-    buttons = []
-    for period in periods:
-        start_str = period.split("–")[0]
-        start_time = datetime.strptime(start_str, "%H:%M").time()
-
-        count = count_bookings_for_period(date_obj, period)
-
-        if is_today and now.time() > start_time:
-            buttons.append([InlineKeyboardButton(f"⛔ {period}", callback_data="ignore")])
-        elif count >= max_allowed:
-            buttons.append([InlineKeyboardButton(f"⛔ {period}", callback_data="full")])
-        else:
-            buttons.append([InlineKeyboardButton(period, callback_data=f"super_time_{period}")])
+    occupancy = await get_occupancy_async(date_obj, date_obj)
+    reply_markup = keyboard_cache.time_picker(SUPERUSER, package, date_obj, occupancy)
 
     await update.callback_query.message.edit_text(
-        "⏰ Select time slot:", reply_markup=InlineKeyboardMarkup(buttons)
+        "⏰ Select time slot:", reply_markup=reply_markup
     )
 
 
-async def handle_superuser_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    time_period = update.callback_query.data.split("_", 2)[2]
+async def handle_superuser_time(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: SuperTime):
+    time_period = payload.period
     client_id = context.user_data["client_id"]
     date_value = context.user_data["date"]
     visit_number = context.user_data["visit_number"]
 
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO visit_logs (client_id, visit_number, visit_date, time_period)
-        VALUES (%s, %s, %s, %s)
-    """, (client_id, visit_number, date_value, time_period))
-    conn.commit()
-    cur.close()
+    if not await log_visit_async(client_id, visit_number, date_value, time_period):
+        await update.callback_query.answer("⛔ This slot is already full.", show_alert=True)
+        return
 
     await update.callback_query.message.edit_text(
-        f"✅ Visit logged for superuser on {date_value.strftime('%d/%m/%Y')} at {time_period}"
+        f"✅ Visit logged for superuser on {keyboard_cache.format_date(date_value)} at {time_period}"
     )
 
 
@@ -109,6 +72,7 @@ async def ask_superuser_children(update: Update, context: ContextTypes.DEFAULT_T
     context.user_data["client_id"] = SUPERUSER_ID
     context.user_data["password"] = SUPERUSER_PASSWORD
     context.user_data["visit_number"] = 1
+    text_router.expect(update.effective_user.id, SUPERUSER_CHILDREN)
 
     await query.message.edit_text("👶 Enter number of children:")
     return SUPER_CHILDREN
@@ -124,11 +88,11 @@ async def handle_superuser_children(update: Update, context: ContextTypes.DEFAUL
         return SUPER_CHILDREN
 
     context.user_data["children"] = int(text)
+    text_router.clear(update.effective_user.id, SUPERUSER_CHILDREN)
 
     keyboard = [
-        [InlineKeyboardButton("8 Visits", callback_data="super_pkg_8")],
-        [InlineKeyboardButton("10 Visits", callback_data="super_pkg_10")],
-        [InlineKeyboardButton("12 Visits", callback_data="super_pkg_12")],
+        [InlineKeyboardButton(f"{package} Visits", callback_data=encode(SuperPackage(package)))]
+        for package in schedule.packages
     ]
     await update.message.reply_text("Select package type:", reply_markup=InlineKeyboardMarkup(keyboard))
     return ConversationHandler.END  # We are not using classic conversation here
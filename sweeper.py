@@ -0,0 +1,43 @@
+import logging
+from config import SWEEP_INTERVAL, SWEEP_BATCH_SIZE, STALE_SESSION_AGE
+from db import sweep_expired_clients_async, sweep_stale_sessions_async, maintain_visit_logs_async
+from session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+
+async def sweep(context=None):
+    # Runs each statement in batches of SWEEP_BATCH_SIZE rows until nothing is left,
+    # so no single transaction holds locks on a large part of a table
+    clients = 0
+    while True:
+        removed = await sweep_expired_clients_async(SWEEP_BATCH_SIZE)
+        for client_id in removed:
+            session_store.invalidate_client(client_id)
+        clients += len(removed)
+        if len(removed) < SWEEP_BATCH_SIZE:
+            break
+
+    sessions = 0
+    while True:
+        removed = await sweep_stale_sessions_async(SWEEP_BATCH_SIZE, STALE_SESSION_AGE)
+        sessions += removed
+        if removed < SWEEP_BATCH_SIZE:
+            break
+
+    logger.info("Expiry sweep archived %d clients and removed %d stale sessions", clients, sessions)
+    return clients, sessions
+
+
+async def maintain_partitions(context=None):
+    created, dropped = await maintain_visit_logs_async()
+    if created or dropped:
+        logger.info("visit_logs partitions created: %s; rolled up and dropped: %s",
+                    ", ".join(created) or "none", ", ".join(dropped) or "none")
+
+
+def schedule_sweeper(job_queue):
+    if SWEEP_INTERVAL > 0:
+        job_queue.run_repeating(sweep, interval=SWEEP_INTERVAL, first=60, name="expiry-sweeper")
+    # Also run by init_db on startup; daily keeps a long-running bot ahead of the calendar
+    job_queue.run_repeating(maintain_partitions, interval=24 * 3600, first=24 * 3600, name="visit-log-partitions")
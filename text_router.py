@@ -0,0 +1,39 @@
+from routing import HandlerTable
+
+# Which kind of free-text input each user is expected to send next
+CHILDREN_COUNT = "children_count"
+SUPERUSER_CHILDREN = "superuser_children"
+# Messages are consumed by the add-client ConversationHandler; nothing to route
+ADMIN_WIZARD = "admin_wizard"
+
+
+class TextRouter(HandlerTable):
+    """Sends each plain text message to at most one handler, chosen by in-memory state.
+
+    Handlers that ask the user to type something call expect(); messages from users
+    with no pending input are dropped without touching the database.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pending = {}
+
+    def expect(self, user_id, state):
+        self._pending[user_id] = state
+
+    def clear(self, user_id, state=None):
+        if state is None or self._pending.get(user_id) == state:
+            self._pending.pop(user_id, None)
+
+    def pending(self, user_id):
+        return self._pending.get(user_id)
+
+    async def dispatch(self, update, context):
+        if not update.effective_user:
+            return
+        handler = self._handlers.get(self._pending.get(update.effective_user.id))
+        if handler is not None:
+            return await handler(update, context)
+
+
+text_router = TextRouter()
@@ -0,0 +1,117 @@
+"""Opt-in SQL tracing per Telegram update (DB_TRACE=1), for development and load tests.
+
+Every statement executed while an update is processed is recorded with the db.py function
+that issued it, the shape of its parameters (types only, never values) and its duration.
+When the update is done, one JSON line is logged to the "db.trace" logger; statements that
+ran more than DB_TRACE_REPEAT_LIMIT times in the update are listed under "repeated" and the
+line is logged as a warning, which is how N+1 query patterns show up.
+"""
+import contextvars
+import json
+import logging
+import re
+import sys
+import time
+from config import DB_TRACE, DB_TRACE_REPEAT_LIMIT, DB_TRACE_LOG
+from metrics import MeteredCursor
+
+logger = logging.getLogger("db.trace")
+
+# Statements longer than this are cut in the log
+MAX_STATEMENT_LENGTH = 300
+# Values inlined by execute_values (bytes queries) must not reach the log
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+_trace = contextvars.ContextVar("db_trace", default=None)
+
+
+def _shape(value):
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def _statement(query):
+    if isinstance(query, bytes):
+        query = _LITERALS.sub("?", query.decode("utf-8", "replace"))
+    elif not isinstance(query, str):
+        query = str(query)
+    return _SPACES.sub(" ", query).strip()[:MAX_STATEMENT_LENGTH]
+
+
+class TracingCursor(MeteredCursor):
+    # Records statements only while trace_update() is active; otherwise it is a MeteredCursor
+    def execute(self, query, vars=None):
+        trace = _trace.get()
+        if trace is None:
+            return super().execute(query, vars)
+
+        # The caller is the first frame outside psycopg2 and this cursor's own execute() overrides
+        frame = sys._getframe(1)
+        while frame.f_back and (frame.f_globals.get("__name__", "").startswith("psycopg2")
+                                or frame.f_locals.get("self") is self):
+            frame = frame.f_back
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            if vars is None:
+                params = None
+            elif isinstance(vars, dict):
+                params = {key: _shape(value) for key, value in vars.items()}
+            else:
+                params = [_shape(value) for value in vars]
+            trace.append({
+                "sql": _statement(query),
+                "params": params,
+                "caller": frame.f_code.co_name,
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def _configure_log():
+    if DB_TRACE_LOG:
+        handler = logging.FileHandler(DB_TRACE_LOG, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+
+if DB_TRACE:
+    _configure_log()
+
+
+async def trace_update(update, coroutine):
+    trace = []
+    _trace.set(trace)
+    started = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        if trace:
+            log_trace(update, trace, time.perf_counter() - started)
+
+
+def log_trace(update, trace, elapsed):
+    counts = {}
+    for statement in trace:
+        counts[statement["sql"]] = counts.get(statement["sql"], 0) + 1
+    repeated = [
+        {"sql": sql, "count": count, "callers": sorted({s["caller"] for s in trace if s["sql"] == sql})}
+        for sql, count in counts.items() if count > DB_TRACE_REPEAT_LIMIT
+    ]
+    user = getattr(update, "effective_user", None)
+    query = getattr(update, "callback_query", None)
+    record = {
+        "update_id": getattr(update, "update_id", None),
+        "user_id": user.id if user else None,
+        "callback": query.data.split(":", 1)[0] if query and query.data else None,
+        "statements": len(trace),
+        "db_ms": round(sum(s["ms"] for s in trace), 3),
+        "update_ms": round(elapsed * 1000, 3),
+        "repeated": repeated,
+        "trace": trace,
+    }
+    logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record, ensure_ascii=False, default=str))
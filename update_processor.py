@@ -0,0 +1,78 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import DB_TRACE
+from metrics import observe_update
+from tracing import trace_update
+from profiler import update_processed
+
+# Updates accepted at once, including those waiting for their user's lock or a slot
+MAX_PENDING_UPDATES = 10_000
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users concurrently, each user's updates in order.
+
+    The per-user lock is taken before a concurrency slot, so a user flooding the bot
+    queues behind their own updates instead of occupying every slot.
+    """
+
+    __slots__ = ("_locks", "_waiters", "_slots", "_running")
+
+    def __init__(self, max_concurrent_updates):
+        # The base class only bounds the updates waiting here; the real limit is _slots, taken
+        # in do_process_update once the user's lock is held
+        super().__init__(MAX_PENDING_UPDATES)
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}
+        self._waiters = {}
+        self._running = 0
+
+    @property
+    def current_concurrent_updates(self):
+        # Updates holding a slot; those queued behind their user's lock are not counted
+        return self._running
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                return await self._process(update, coroutine)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock, self._slots:
+                await self._process(update, coroutine)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def _process(self, update, coroutine):
+        if DB_TRACE:
+            coroutine = trace_update(update, coroutine)
+        self._running += 1
+        try:
+            await observe_update(coroutine)
+        finally:
+            self._running -= 1
+            update_processed(update)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
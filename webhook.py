@@ -0,0 +1,78 @@
+import asyncio
+import hmac
+import logging
+import signal
+from aiohttp import web
+from telegram import Update
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def check_config():
+    # Without a secret anyone can POST forged updates (e.g. from the admin's user ID), so a
+    # publicly registered webhook must have one; local serving (no WEBHOOK_URL) may go without
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when WEBHOOK_URL is set")
+
+
+def create_web_app(app):
+    # The aiohttp app only validates and enqueues; the Application processes updates
+    async def telegram_update(request):
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), app.bot)
+        except (ValueError, TypeError, KeyError):
+            return web.Response(status=400)
+        await app.update_queue.put(update)
+        return web.Response()
+
+    async def health(request):
+        return web.json_response({
+            "status": "ok" if app.running else "starting",
+            "pending_updates": app.update_queue.qsize(),
+            "concurrent_updates": app.update_processor.current_concurrent_updates,
+        }, status=200 if app.running else 503)
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, telegram_update)
+    web_app.router.add_get("/healthz", health)
+    return web_app
+
+
+async def run_webhook(app, on_startup=None, on_shutdown=None):
+    check_config()
+    # Application.run_webhook would also call post_init/post_shutdown; we have to do it ourselves
+    runner = web.AppRunner(create_web_app(app))
+    # SIGTERM (container stop) and SIGINT end the wait below, so the shutdown steps still run
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    async with app:
+        if on_startup:
+            await on_startup(app)
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await app.start()
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info("Webhook server listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        try:
+            await stop.wait()
+            logger.info("Stop signal received, shutting down")
+        finally:
+            await runner.cleanup()
+            await app.stop()
+            if on_shutdown:
+                await on_shutdown(app)